@@ -1,89 +1,455 @@
 # app.py
 import datetime
-from flask import Flask, render_template, request, redirect, url_for,flash
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, joinedload
-from models import Base, Estudiante, Materia, Inscripcion, Asistencia, Profesor
+import glob
+import hashlib
+import io
+import os
+import click
+from flask import Flask, Response, abort, jsonify, render_template, request, redirect, stream_with_context, url_for,flash
+from flask import session as sesion_http
+from markupsafe import Markup
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import contains_eager, joinedload, load_only
+from werkzeug.http import is_resource_modified
+from models import Estudiante, Materia, Inscripcion, Asistencia, EstadoTrabajo, Profesor, Purga, UmbralAsistencia, engine, session
+from archivo import FechaArchivada, archivar, comprobar_fechas, fecha_limite_archivo
+from cache import cache
+from cola_asistencia import COLA_ACTIVA, COLA_HILO, ColaAsistencia, ejecutar_escritor, iniciar_escritor
+from exportacion import generar_csv
+from importacion import IMPORTADORES, importar_csv
+from instrumentacion import init_instrumentacion
+from purgas import borrar_inscripciones, borrar_materia, ejecutar_purgas, iniciar_purgas, progreso_purga
+from reportes import (
+    INTERVALO_REPORTE, TRABAJO_REPORTE, UMBRAL_POR_DEFECTO, actualizar_reporte, consultar_reporte, guardar_umbrales,
+    iniciar_trabajo_reporte,
+)
+from servicios import (
+    ALTA, BAJA, MODIFICACION, EstadisticaAsistencia, alternar_asistencia, cambios_asistencias, cambios_inscripciones, estadisticas_asistencia, historial_asistencias,
+    buscar_estudiantes, listado_materias, listado_profesores, matriz_asistencia, reconstruir_resumen,
+    incrementar_versiones, registrar_asistencia_materia, registrar_cambio_inscripciones, registrar_hojas, versiones_datos,
+)
 
 app = Flask(__name__)
 
 app.secret_key = '123'
 
-
-# Conexión a la base de datos
-engine = create_engine('sqlite:///asistencia.db')
-Base.metadata.bind = engine
-DBSession = sessionmaker(bind=engine)
-session = DBSession()
+# Perfilado opcional por petición (ver instrumentacion.py)
+app.config.update(
+    PERFILADO=os.environ.get('ASISTENCIA_PERFILADO') == '1',
+    PERFIL_CABECERA=os.environ.get('ASISTENCIA_PERFIL_CABECERA') == '1',
+    PERFIL_MAX_CONSULTAS=int(os.environ.get('ASISTENCIA_PERFIL_MAX_CONSULTAS', 20)),
+    PERFIL_MAX_MS=float(os.environ.get('ASISTENCIA_PERFIL_MAX_MS', 500)),
+    PERFIL_TOKEN=os.environ.get('ASISTENCIA_PERFIL_TOKEN'),
+)
+init_instrumentacion(app, engine)
+
+# Ingesta diferida opcional de registrar_asistencia (ver cola_asistencia.py)
+cola = ColaAsistencia() if COLA_ACTIVA else None
+
+
+@app.before_request
+def arrancar_escritor():
+    """Arranca el escritor de la cola con la primera petición del worker.
+
+    No al importar app: los comandos `flask` (incluido procesar-cola) no deben
+    tener un segundo escritor en segundo plano.
+    """
+    if cola is not None and COLA_HILO:
+        iniciar_escritor(app, cola, session)
+
+
+# Actualización periódica del reporte de riesgo (ver reportes.py)
+@app.before_request
+def arrancar_trabajo_reporte():
+    """Arranca el trabajo del reporte con la primera petición del worker.
+
+    Como el escritor de la cola: no al importar app, para que no corra bajo
+    los comandos `flask` (en `flask reporte-riesgo` competiría con la ejecución manual).
+    """
+    if INTERVALO_REPORTE > 0:
+        iniciar_trabajo_reporte(app, session)
+
+
+# Conexión a la base de datos: el engine y la sesión (una por petición) viven en models.py
+@app.teardown_appcontext
+def cerrar_sesion(exception=None):
+    """Devuelve la conexión al pool al terminar cada petición."""
+    if exception is not None:
+        session.rollback()
+    session.remove()
+
+# Listados de referencia cacheados (ver cache.py); las rutas que modifican
+# profesores, materias o estudiantes invalidan su prefijo tras el commit.
+def _profesores_activos():
+    return cache.obtener('profesores:activos', lambda: listado_profesores(session))
+
+def _busqueda_estudiantes():
+    """Página de estudiantes activos según ?q= y ?pagina=; devuelve (texto, pagina, estudiantes, hay_mas)."""
+    texto = request.args.get('q', '').strip()
+    pagina = max(request.args.get('pagina', 1, type=int), 1)
+    estudiantes, hay_mas = cache.obtener(
+        f'estudiantes:busqueda:{pagina}:{texto.lower()}', lambda: buscar_estudiantes(session, texto, pagina)
+    )
+    return texto, pagina, estudiantes, hay_mas
+
+def _pagina_estudiantes():
+    texto, pagina, estudiantes, hay_mas = _busqueda_estudiantes()
+    return render_template('estudiantes.html', estudiantes=estudiantes, q=texto, pagina=pagina, hay_mas=hay_mas)
+
+# Páginas de solo lectura con versión de datos (tabla versiones): ETag para que
+# el navegador reciba 304, y caché del HTML renderizado con la versión en la
+# clave, así que no hace falta invalidarla. No se envía Last-Modified: tiene
+# resolución de un segundo y no refleja la versión de la aplicación.
+def _version_aplicacion():
+    """Huella del código y las plantillas: cambia con cada despliegue e igual en todos los workers."""
+    huella = hashlib.sha1()
+    for patron in ('*.py', 'templates/*.html'):
+        for archivo in sorted(glob.glob(os.path.join(app.root_path, patron))):
+            with open(archivo, 'rb') as f:
+                huella.update(f.read())
+    return huella.hexdigest()
+
+# Forma parte del ETag: tras un despliegue no se sirve HTML de la versión anterior
+VERSION_APLICACION = os.environ.get('ASISTENCIA_VERSION') or _version_aplicacion()
+
+def _pagina_versionada(claves, renderizar, *extra):
+    """Responde 304 si el navegador ya tiene esta versión; si no, sirve el HTML de la caché o lo renderiza.
+
+    El ETag combina la versión de la aplicación, la ruta, sus parámetros, las
+    versiones de 'claves' y 'extra'.
+    Con mensajes flash pendientes la página se renderiza sin caché (base.html los muestra y los consume).
+    """
+    if '_flashes' in sesion_http:
+        return renderizar()
+    versiones = versiones_datos(session, claves)
+    firma = repr((VERSION_APLICACION, request.endpoint, sorted(request.view_args.items()), sorted(request.args.items(multi=True)),
+                  versiones, extra))
+    etag = hashlib.sha1(firma.encode()).hexdigest()
+
+    respuesta = app.response_class(mimetype='text/html')
+    respuesta.set_etag(etag)
+    # El navegador puede guardar la página, pero debe revalidarla en cada visita
+    respuesta.cache_control.private = True
+    respuesta.cache_control.no_cache = True
+    if not is_resource_modified(request.environ, etag=etag):
+        respuesta.status_code = 304
+        return respuesta
+    respuesta.set_data(cache.obtener(f'pagina:{etag}', renderizar))
+    return respuesta
 
 @app.route('/')
 def index():
     """Página principal que muestra la lista de materias."""
-    # --- CONSULTA MODIFICADA ---
-    # Unimos con Profesor para filtrar por 'is_active'
-    materias = session.query(Materia).join(Profesor).filter(Profesor.is_active == True).all()
+    # Materias de profesores activos, desde la caché de listados
+    materias = cache.obtener('materias:index', lambda: listado_materias(session))
     return render_template('index.html', materias=materias)
 
 @app.route('/materia/<int:materia_id>')
 def materia_detalle(materia_id):
     """Página para tomar asistencia de una materia específica."""
-    materia = session.query(Materia).filter_by(id=materia_id).one()
-    
-    inscripciones = session.query(Inscripcion).join(Estudiante).filter(
-        Inscripcion.materia_id == materia_id,
-        Estudiante.is_active == True
-    ).all()
-    
     today = datetime.date.today().strftime("%Y-%m-%d")
-    return render_template('materia_detalle.html', materia=materia, inscripciones=inscripciones, today=today)
+
+    def renderizar():
+        materia = session.query(Materia).filter_by(id=materia_id).one()
+
+        # contains_eager reutiliza el JOIN para cargar al estudiante (evita N+1 en la plantilla)
+        inscripciones = session.query(Inscripcion).join(Inscripcion.estudiante).options(
+            contains_eager(Inscripcion.estudiante)
+        ).filter(
+            Inscripcion.materia_id == materia_id,
+            Estudiante.is_active == True
+        ).all()
+        return render_template('materia_detalle.html', materia=materia, inscripciones=inscripciones, today=today)
+
+    # La página lleva la fecha del día: cambia a medianoche aunque los datos no cambien
+    return _pagina_versionada([f'materia:{materia_id}'], renderizar, today)
 
 @app.route('/registrar_asistencia', methods=['POST'])
 def registrar_asistencia():
     """Procesa el formulario de asistencia."""
-    materia_id = request.form.get('materia_id')
+    materia_id = int(request.form.get('materia_id'))
     fecha_str = request.form.get('fecha')
     fecha = datetime.datetime.strptime(fecha_str, '%Y-%m-%d').date()
     
-    # Obtener todas las inscripciones para esta materia
-    inscripciones_totales = session.query(Inscripcion).filter_by(materia_id=materia_id).all()
-    
     # Obtener la lista de IDs de inscripciones de los estudiantes marcados como presentes
     presentes_ids = request.form.getlist('presente') # getlist obtiene todos los valores con el mismo name
     presentes_ids = [int(id) for id in presentes_ids] # Convertir a enteros
 
-    # Eliminar registros de asistencia previos para esta fecha y materia para evitar duplicados
-    inscripciones_ids_materia = [insc.id for insc in inscripciones_totales]
-    session.query(Asistencia).filter(Asistencia.inscripcion_id.in_(inscripciones_ids_materia), Asistencia.fecha == fecha).delete(synchronize_session=False)
-    session.commit()
-
-    # Registrar la asistencia para todos los estudiantes inscritos
-    for inscripcion in inscripciones_totales:
-        asistio = inscripcion.id in presentes_ids
-        nuevo_registro = Asistencia(
-            inscripcion_id=inscripcion.id,
-            fecha=fecha,
-            presente=asistio
-        )
-        session.add(nuevo_registro)
-    
+    try:
+        if cola is not None:
+            # Modo cola: se valida, se guarda el envío y el escritor lo aplica después
+            if session.get(Materia, materia_id) is None:
+                abort(404)
+            comprobar_fechas(session, [fecha])
+            cola.encolar(materia_id, fecha, presentes_ids)
+            flash('Asistencia recibida; se aplicará en unos segundos.', 'success')
+            return redirect(url_for('ver_asistencias', materia_id=materia_id))
+
+        # Upsert por (inscripcion_id, fecha) en una sola transacción: solo se
+        # escriben los registros nuevos o cuyo estado cambió
+        resultado = registrar_asistencia_materia(session, materia_id, fecha, presentes_ids)
+    except FechaArchivada as error:
+        flash(str(error), 'danger')
+        return redirect(url_for('materia_detalle', materia_id=materia_id))
     session.commit()
+    flash(f'Asistencia registrada: {resultado.insertados} nuevos, {resultado.actualizados} actualizados, '
+          f'{resultado.sin_cambios} sin cambios.', 'success')
     return redirect(url_for('ver_asistencias', materia_id=materia_id))
 
+@app.route('/cola/estado')
+def estado_cola():
+    """Profundidad y retraso de la cola de asistencia (JSON)."""
+    if cola is None:
+        return jsonify({'activa': False})
+    return jsonify({'activa': True, **cola.estado()})
+
+def _fecha_parametro(nombre):
+    """Lee un parámetro de consulta con formato AAAA-MM-DD (None si falta o es inválido)."""
+    valor = request.args.get(nombre)
+    try:
+        return datetime.datetime.strptime(valor, '%Y-%m-%d').date() if valor else None
+    except ValueError:
+        return None
+
+def _cursor_parametro():
+    """Lee el cursor de paginación 'AAAA-MM-DD_id' del historial."""
+    valor = request.args.get('cursor', '')
+    fecha_str, _, id_str = valor.partition('_')
+    try:
+        return datetime.datetime.strptime(fecha_str, '%Y-%m-%d').date(), int(id_str)
+    except ValueError:
+        return None
+
 @app.route('/asistencias/<int:materia_id>')
 def ver_asistencias(materia_id):
-    """Muestra el historial de asistencias de una materia."""
+    """Muestra el historial de asistencias de una materia, paginado y filtrable."""
+    def renderizar():
+        materia = session.query(Materia).filter_by(id=materia_id).one()
+        filtros = {
+            'desde': _fecha_parametro('desde'),
+            'hasta': _fecha_parametro('hasta'),
+            'estudiante_id': request.args.get('estudiante_id', type=int),
+        }
+        asistencias, siguiente = historial_asistencias(session, materia_id, cursor=_cursor_parametro(), **filtros)
+
+        # Estudiantes inscritos, para el filtro
+        inscripciones = session.query(Inscripcion).join(Inscripcion.estudiante).options(
+            contains_eager(Inscripcion.estudiante)
+        ).filter(Inscripcion.materia_id == materia_id).order_by(Estudiante.apellido, Estudiante.nombre).all()
+
+        return render_template(
+            'asistencias.html',
+            materia=materia,
+            asistencias=asistencias,
+            inscripciones=inscripciones,
+            filtros=filtros,
+            cursor_siguiente=f"{siguiente[0]:%Y-%m-%d}_{siguiente[1]}" if siguiente else None,
+            es_primera_pagina='cursor' not in request.args,
+        )
+
+    # 'archivo' cambia al archivar un periodo (los registros dejan de ser editables)
+    return _pagina_versionada([f'materia:{materia_id}', 'archivo'], renderizar)
+
+@app.route('/asistencias/<int:materia_id>/matriz')
+def matriz_asistencias(materia_id):
+    """Muestra la asistencia de una materia como matriz estudiantes x fechas."""
     materia = session.query(Materia).filter_by(id=materia_id).one()
-    asistencias = session.query(Asistencia).join(Inscripcion).filter(Inscripcion.materia_id == materia_id).all()
-    return render_template('asistencias.html', materia=materia, asistencias=asistencias)
+    filtros = {'desde': _fecha_parametro('desde'), 'hasta': _fecha_parametro('hasta')}
+    matriz = matriz_asistencia(session, materia_id, **filtros)
+    return render_template('asistencias_matriz.html', materia=materia, matriz=matriz, filtros=filtros)
+
+
+# --- EXPORTACIÓN CSV ---
+
+def _respuesta_csv(nombre_archivo, **filtros):
+    """Envía el CSV en streaming, sin construir el archivo completo en memoria."""
+    return Response(
+        stream_with_context(generar_csv(session, **filtros)),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename="{nombre_archivo}"'},
+    )
+
+@app.route('/exportar/materia/<int:materia_id>')
+def exportar_materia(materia_id):
+    """Exporta la asistencia de una materia (opcionalmente entre dos fechas)."""
+    materia = session.query(Materia).get(materia_id)
+    if not materia:
+        return "Materia no encontrada", 404
+    return _respuesta_csv(
+        f"asistencia_{materia.codigo_materia}.csv",
+        materia_id=materia_id,
+        desde=_fecha_parametro('desde'),
+        hasta=_fecha_parametro('hasta'),
+    )
+
+@app.route('/exportar/estudiante/<int:estudiante_id>')
+def exportar_estudiante(estudiante_id):
+    """Exporta la asistencia de un estudiante en todas sus materias."""
+    estudiante = session.query(Estudiante).get(estudiante_id)
+    if not estudiante:
+        return "Estudiante no encontrado", 404
+    return _respuesta_csv(
+        f"asistencia_{estudiante.codigo_estudiante}.csv",
+        estudiante_id=estudiante_id,
+        desde=_fecha_parametro('desde'),
+        hasta=_fecha_parametro('hasta'),
+    )
+
+@app.route('/exportar/asistencias')
+def exportar_asistencias():
+    """Exporta la asistencia de toda la institución entre dos fechas."""
+    desde, hasta = _fecha_parametro('desde'), _fecha_parametro('hasta')
+    nombre = f"asistencia_{desde or 'inicio'}_{hasta or 'hoy'}.csv"
+    return _respuesta_csv(nombre, desde=desde, hasta=hasta)
+
+
+# --- IMPORTACIÓN CSV ---
+
+@app.route('/importar', methods=['GET', 'POST'])
+def importar_datos():
+    """Importa estudiantes, materias o inscripciones desde un archivo CSV."""
+    if request.method == 'POST':
+        tipo = request.form.get('tipo')
+        archivo = request.files.get('archivo')
+        if tipo not in IMPORTADORES or not archivo or not archivo.filename:
+            flash('Seleccione el tipo de datos y un archivo CSV.', 'danger')
+            return render_template('importar.html', tipos=IMPORTADORES)
+
+        # Se lee el archivo subido en streaming, sin cargarlo completo en memoria
+        texto = io.TextIOWrapper(archivo.stream, encoding='utf-8-sig', newline='')
+        try:
+            resultado = importar_csv(session, tipo, texto)
+        except UnicodeDecodeError:
+            session.rollback()
+            flash('El archivo debe estar codificado en UTF-8.', 'danger')
+            return render_template('importar.html', tipos=IMPORTADORES)
+        finally:
+            # Los lotes ya confirmados son visibles aunque la importación falle
+            cache.invalidar(tipo)
+        flash(f'{resultado.insertados} registro(s) importado(s), {len(resultado.errores)} error(es).',
+              'success' if not resultado.errores else 'warning')
+        return render_template('importar.html', tipos=IMPORTADORES, tipo=tipo, resultado=resultado)
+
+    return render_template('importar.html', tipos=IMPORTADORES)
+
+
+# --- API JSON (captura sin conexión y sincronización de dispositivos) ---
+
+# Máximo de listas de asistencia por petición a /api/asistencias/lote
+MAX_HOJAS_LOTE = 500
+
+def _leer_hojas(datos):
+    """Valida el cuerpo de /api/asistencias/lote y devuelve (hojas, errores)."""
+    if not isinstance(datos, dict) or not isinstance(datos.get('hojas'), list):
+        return [], [{'hoja': None, 'error': "Se esperaba un objeto JSON con la lista 'hojas'."}]
+    if len(datos['hojas']) > MAX_HOJAS_LOTE:
+        return [], [{'hoja': None, 'error': f'Como máximo {MAX_HOJAS_LOTE} hojas por petición.'}]
+    hojas, errores = [], []
+    for indice, hoja in enumerate(datos['hojas']):
+        try:
+            materia_id = hoja['materia_id']
+            fecha = datetime.date.fromisoformat(hoja['fecha'])
+            presentes = hoja.get('presentes', [])
+            if not isinstance(materia_id, int) or not isinstance(presentes, list) \
+                    or not all(isinstance(id, int) for id in presentes):
+                raise ValueError
+        except (KeyError, TypeError, ValueError, AttributeError):
+            errores.append({'hoja': indice, 'error': 'Se esperaba materia_id (entero), fecha (AAAA-MM-DD) '
+                                                     'y presentes (lista de ids de inscripción).'})
+            continue
+        hojas.append((materia_id, fecha, presentes))
+    return hojas, errores
+
+@app.route('/api/asistencias/lote', methods=['POST'])
+def api_registrar_lote():
+    """Registra en una transacción varias listas de asistencia (materias y fechas).
+
+    Cuerpo: {"hojas": [{"materia_id": 1, "fecha": "2024-03-01", "presentes": [ids de inscripción]}]}.
+    Reenviar el mismo lote no cambia nada; si falla alguna hoja no se aplica ninguna.
+    """
+    hojas, errores = _leer_hojas(request.get_json(silent=True))
+    if not errores:
+        materias = {materia_id for materia_id, _, _ in hojas}
+        existentes = set(session.scalars(select(Materia.id).where(Materia.id.in_(materias))))
+        limite_archivo = fecha_limite_archivo(session)
+        errores = [
+            {'hoja': indice, 'error': f'No existe la materia {materia_id}.'}
+            for indice, (materia_id, _, _) in enumerate(hojas) if materia_id not in existentes
+        ] + [
+            {'hoja': indice, 'error': f'La fecha {fecha.isoformat()} pertenece a un periodo archivado.'}
+            for indice, (_, fecha, _) in enumerate(hojas) if limite_archivo is not None and fecha <= limite_archivo
+        ]
+    if errores:
+        return jsonify({'errores': errores}), 400
+
+    resultado, ignorados = registrar_hojas(session, hojas)
+    session.commit()
+    return jsonify({
+        'insertados': resultado.insertados,
+        'actualizados': resultado.actualizados,
+        'sin_cambios': resultado.sin_cambios,
+        'hojas': [
+            {'materia_id': materia_id, 'fecha': fecha.isoformat(), 'ignorados': ids}
+            for (materia_id, fecha, _), ids in zip(hojas, ignorados)
+        ],
+    })
+
+@app.route('/api/cambios/inscripciones')
+def api_cambios_inscripciones():
+    """Altas, bajas y modificaciones de inscripciones desde ?cursor= (filtrables por ?materia_id=)."""
+    cursor = 0
+    if request.args.get('cursor'):
+        try:
+            cursor = int(request.args['cursor'])
+        except ValueError:
+            return jsonify({'errores': [{'error': 'Cursor inválido; se esperaba un número de cambio.'}]}), 400
+    cambios, cursor, hay_mas = cambios_inscripciones(
+        session, cursor=cursor, materias_ids=request.args.getlist('materia_id', type=int),
+    )
+    return jsonify({'cambios': cambios, 'cursor': cursor, 'hay_mas': hay_mas})
+
+@app.route('/api/cambios/asistencias')
+def api_cambios_asistencias():
+    """Registros de asistencia escritos desde ?cursor=version_id (sin cursor, todos)."""
+    cursor = None
+    if request.args.get('cursor'):
+        version_str, _, id_str = request.args['cursor'].partition('_')
+        try:
+            cursor = (int(version_str), int(id_str))
+        except ValueError:
+            return jsonify({'errores': [{'error': "Cursor inválido; se esperaba 'version_id'."}]}), 400
+    asistencias, cursor, hay_mas = cambios_asistencias(
+        session, cursor=cursor, materias_ids=request.args.getlist('materia_id', type=int),
+    )
+    return jsonify({
+        'asistencias': asistencias,
+        'cursor': f'{cursor[0]}_{cursor[1]}' if cursor else None,
+        'hay_mas': hay_mas,
+    })
 
 
 # --- CRUD DE ESTUDIANTES ---
 
 @app.route('/estudiantes')
 def lista_estudiantes():
-    """Lee y muestra todos los estudiantes ACTIVOS."""
-    estudiantes = session.query(Estudiante).filter_by(is_active=True).order_by(Estudiante.apellido).all()
-    return render_template('estudiantes.html', estudiantes=estudiantes)
+    """Lee y muestra los estudiantes ACTIVOS, paginados y filtrables con ?q=."""
+    return _pagina_estudiantes()
+
+@app.route('/estudiantes/buscar')
+def buscar_estudiantes_ruta():
+    """Búsqueda por prefijo de nombre, apellido o código (JSON con ?formato=json o Accept)."""
+    if request.args.get('formato') != 'json' and request.accept_mimetypes.best != 'application/json':
+        return _pagina_estudiantes()
+    texto, pagina, estudiantes, hay_mas = _busqueda_estudiantes()
+    return jsonify({
+        'estudiantes': [
+            {**estudiante, 'url': url_for('detalle_inscripcion_estudiante', estudiante_id=estudiante['id'])}
+            for estudiante in estudiantes
+        ],
+        'pagina': pagina,
+        'hay_mas': hay_mas,
+    })
 
 @app.route('/estudiantes/nuevo', methods=['GET', 'POST'])
 def nuevo_estudiante():
@@ -103,6 +469,7 @@ def nuevo_estudiante():
         )
         session.add(nuevo)
         session.commit()
+        cache.invalidar('estudiantes')
         flash('Estudiante añadido con éxito.', 'success')
         return redirect(url_for('lista_estudiantes'))
     
@@ -126,7 +493,9 @@ def editar_estudiante(estudiante_id):
         estudiante.nombre = request.form['nombre']
         estudiante.apellido = request.form['apellido']
         estudiante.codigo_estudiante = request.form['codigo_estudiante']
+        registrar_cambio_inscripciones(session, MODIFICACION, Inscripcion.estudiante_id == estudiante_id)
         session.commit()
+        cache.invalidar('estudiantes')
         flash('Estudiante actualizado con éxito.', 'success')
         return redirect(url_for('lista_estudiantes'))
 
@@ -138,7 +507,9 @@ def eliminar_estudiante(estudiante_id):
     estudiante = session.query(Estudiante).get(estudiante_id)
     if estudiante:
         estudiante.is_active = False 
+        registrar_cambio_inscripciones(session, MODIFICACION, Inscripcion.estudiante_id == estudiante_id)
         session.commit()
+        cache.invalidar('estudiantes')
         flash('Estudiante eliminado con éxito.', 'warning')
     return redirect(url_for('lista_estudiantes'))
 
@@ -148,7 +519,7 @@ def eliminar_estudiante(estudiante_id):
 @app.route('/profesores')
 def lista_profesores():
     """Lee y muestra todos los profesores ACTIVOS."""
-    profesores = session.query(Profesor).filter_by(is_active=True).order_by(Profesor.apellido).all()
+    profesores = _profesores_activos()
     return render_template('profesores.html', profesores=profesores)
 
 @app.route('/profesores/nuevo', methods=['GET', 'POST'])
@@ -162,6 +533,7 @@ def nuevo_profesor():
         )
         session.add(nuevo)
         session.commit()
+        cache.invalidar('profesores')
         flash('Profesor añadido con éxito.', 'success')
         return redirect(url_for('lista_profesores'))
     
@@ -178,7 +550,10 @@ def editar_profesor(profesor_id):
         profesor.nombre = request.form['nombre']
         profesor.apellido = request.form['apellido']
         profesor.especialidad = request.form['especialidad']
+        incrementar_versiones(session, f'profesor:{profesor_id}')
         session.commit()
+        # Los listados de materias muestran el nombre del profesor
+        cache.invalidar('profesores', 'materias')
         flash('Profesor actualizado con éxito.', 'success')
         return redirect(url_for('lista_profesores'))
 
@@ -195,7 +570,9 @@ def eliminar_profesor(profesor_id):
             flash(f'No se puede eliminar al profesor {profesor.nombre} {profesor.apellido} porque tiene {materias_asignadas} materia(s) asignada(s). Reasígnelas primero.', 'danger')
         else:
             profesor.is_active = False # Soft Delete
+            incrementar_versiones(session, f'profesor:{profesor_id}')
             session.commit()
+            cache.invalidar('profesores', 'materias')
             flash('Profesor eliminado con éxito.', 'warning')
             
     return redirect(url_for('lista_profesores'))
@@ -203,31 +580,32 @@ def eliminar_profesor(profesor_id):
 @app.route('/profesores/detalle/<int:profesor_id>')
 def detalle_profesor(profesor_id):
     """Muestra los detalles de un profesor y las materias que imparte."""
-    
-    # Usamos joinedload para cargar eficientemente las materias
-    # en la misma consulta para evitar el problema N+1.
-    profesor = session.query(Profesor).options(
-        joinedload(Profesor.materias)
-    ).get(profesor_id)
-    
-    if not profesor:
+    if session.scalar(select(Profesor.id).where(Profesor.id == profesor_id)) is None:
         flash(f'Profesor con ID {profesor_id} no encontrado.', 'danger')
         return redirect(url_for('lista_profesores'))
-        
-    return render_template('profesor_detalle.html', profesor=profesor)
+
+    def renderizar():
+        # Usamos joinedload para cargar eficientemente las materias
+        # en la misma consulta para evitar el problema N+1.
+        profesor = session.query(Profesor).options(
+            joinedload(Profesor.materias)
+        ).get(profesor_id)
+        return render_template('profesor_detalle.html', profesor=profesor)
+
+    return _pagina_versionada([f'profesor:{profesor_id}'], renderizar)
 # --- CRUD DE MATERIAS ---
 
 @app.route('/materias/gestion')
 def lista_materias():
     """Lee y muestra todas las materias para su gestión."""
-    materias = session.query(Materia).join(Profesor).filter(Profesor.is_active == True).order_by(Materia.nombre_materia).all()
+    materias = cache.obtener('materias:gestion', lambda: listado_materias(session, ordenar=True))
     return render_template('index.html', materias=materias)
 
 @app.route('/materias/nuevo', methods=['GET', 'POST'])
 def nueva_materia():
     """Crea una nueva materia."""
     # Necesitamos la lista de profesores activos para el formulario
-    profesores = session.query(Profesor).filter_by(is_active=True).all()
+    profesores = _profesores_activos()
     
     if request.method == 'POST':
         codigo = request.form['codigo_materia']
@@ -242,7 +620,11 @@ def nueva_materia():
             profesor_id=request.form['profesor_id']
         )
         session.add(nueva)
+        session.flush()
+        # Puede reutilizar el id de una materia eliminada: la versión sigue creciendo
+        incrementar_versiones(session, f'materia:{nueva.id}', f'profesor:{nueva.profesor_id}')
         session.commit()
+        cache.invalidar('materias')
         flash('Materia creada con éxito.', 'success')
         return redirect(url_for('lista_materias'))
 
@@ -255,7 +637,7 @@ def editar_materia(materia_id):
     if not materia:
         return "Materia no encontrada", 404
         
-    profesores = session.query(Profesor).filter_by(is_active=True).all()
+    profesores = _profesores_activos()
 
     if request.method == 'POST':
         codigo = request.form['codigo_materia']
@@ -264,10 +646,14 @@ def editar_materia(materia_id):
             flash('El código de materia ya está en uso por otra materia.', 'danger')
             return render_template('materia_form.html', materia=materia, profesores=profesores)
             
+        profesor_anterior = materia.profesor_id
         materia.nombre_materia = request.form['nombre_materia']
         materia.codigo_materia = request.form['codigo_materia']
         materia.profesor_id = request.form['profesor_id']
+        incrementar_versiones(session, f'materia:{materia_id}', f'profesor:{profesor_anterior}',
+                              f'profesor:{materia.profesor_id}')
         session.commit()
+        cache.invalidar('materias')
         flash('Materia actualizada con éxito.', 'success')
         return redirect(url_for('lista_materias'))
 
@@ -278,19 +664,35 @@ def eliminar_materia(materia_id):
     """Elimina una materia (Hard Delete)."""
     materia = session.query(Materia).get(materia_id)
     if materia:
-        session.delete(materia) # SQLAlchemy se encargará de borrar en cascada gracias a la configuración del modelo
+        # Borrados por conjuntos; las materias con mucho historial se purgan en segundo plano
+        incrementar_versiones(session, f'materia:{materia_id}', f'profesor:{materia.profesor_id}')
+        purga = borrar_materia(session, materia_id)
         session.commit()
-        flash('Materia y todos sus datos asociados han sido eliminados.', 'warning')
+        cache.invalidar('materias')
+        if purga is None:
+            flash('Materia y todos sus datos asociados han sido eliminados.', 'warning')
+        else:
+            iniciar_purgas(app, session)
+            flash(Markup('Materia eliminada. Sus {} registros de asistencia se borran en segundo plano '
+                         '(<a href="{}">ver progreso</a>).').format(
+                purga.total, url_for('estado_purga', purga_id=purga.id)), 'warning')
     return redirect(url_for('lista_materias'))
 
+@app.route('/purgas/<int:purga_id>')
+def estado_purga(purga_id):
+    """Progreso del borrado en segundo plano de una materia eliminada (JSON)."""
+    purga = session.get(Purga, purga_id)
+    if purga is None:
+        abort(404)
+    return jsonify(progreso_purga(purga))
+
 
 # --- GESTIÓN DE INSCRIPCIONES ---
 
 @app.route('/inscripciones')
 def gestion_inscripciones():
     """Página principal para la gestión de inscripciones, muestra lista de estudiantes."""
-    estudiantes = session.query(Estudiante).filter_by(is_active=True).order_by(Estudiante.apellido).all()
-    return render_template('estudiantes.html', estudiantes=estudiantes)
+    return _pagina_estudiantes()
 
 @app.route('/inscripciones/estudiante/<int:estudiante_id>')
 def detalle_inscripcion_estudiante(estudiante_id):
@@ -299,30 +701,30 @@ def detalle_inscripcion_estudiante(estudiante_id):
     if not estudiante:
         return "Estudiante no encontrado", 404
 
-    # 1. Obtener las inscripciones actuales del estudiante
-    inscripciones_actuales = session.query(Inscripcion).filter_by(estudiante_id=estudiante_id).options(joinedload(Inscripcion.materia)).all()
+    # 1. Obtener las inscripciones actuales del estudiante (con materia y profesor en la misma consulta)
+    inscripciones_actuales = session.query(Inscripcion).filter_by(estudiante_id=estudiante_id).options(
+        joinedload(Inscripcion.materia).joinedload(Materia.profesor)
+    ).all()
     
-    # --- NUEVA LÓGICA: CALCULAR TASA DE ASISTENCIA ---
+    # 2. Tasa de asistencia de todas las inscripciones con una sola consulta agrupada
+    estadisticas = estadisticas_asistencia(session, estudiante_id=estudiante_id)
     datos_inscripciones = []
     for inscripcion in inscripciones_actuales:
-        total_clases = session.query(Asistencia).filter_by(inscripcion_id=inscripcion.id).count()
-        clases_presente = session.query(Asistencia).filter_by(inscripcion_id=inscripcion.id, presente=True).count()
-        
-        tasa = 0
-        if total_clases > 0:
-            tasa = (clases_presente / total_clases) * 100
-        
+        estadistica = estadisticas.get(inscripcion.id, EstadisticaAsistencia(0, 0, 0))
         datos_inscripciones.append({
             'inscripcion': inscripcion,
-            'detalle': f"{clases_presente} / {total_clases}",
-            'tasa': f"{tasa:.1f}%"
+            'detalle': f"{estadistica.presentes} / {estadistica.total}",
+            'tasa': f"{estadistica.tasa:.1f}%"
         })
 
-    # 2. Obtener los IDs de las materias en las que ya está inscrito
-    ids_materias_inscritas = [insc.materia_id for insc in inscripciones_actuales]
-
-    # 3. Obtener las materias disponibles (todas menos en las que ya está inscrito)
-    materias_disponibles = session.query(Materia).filter(Materia.id.notin_(ids_materias_inscritas)).all()
+    # 3. Obtener las materias disponibles (todas menos en las que ya está inscrito),
+    # filtrando en la base de datos y cargando solo las columnas del formulario
+    materias_inscritas = select(Inscripcion.materia_id).where(
+        Inscripcion.estudiante_id == estudiante_id, Inscripcion.materia_id.isnot(None)
+    )
+    materias_disponibles = session.query(Materia).options(
+        load_only(Materia.id, Materia.nombre_materia, Materia.codigo_materia)
+    ).filter(Materia.id.notin_(materias_inscritas)).order_by(Materia.nombre_materia).all()
 
     return render_template(
         'inscripcion_detalle.html', 
@@ -343,19 +745,27 @@ def inscribir_estudiante():
     else:
         nueva_inscripcion = Inscripcion(estudiante_id=estudiante_id, materia_id=materia_id)
         session.add(nueva_inscripcion)
-        session.commit()
-        flash('Estudiante inscrito correctamente.', 'success')
+        try:
+            session.flush()
+            registrar_cambio_inscripciones(session, ALTA, Inscripcion.id == nueva_inscripcion.id)
+            session.commit()
+            flash('Estudiante inscrito correctamente.', 'success')
+        except IntegrityError:
+            # Otra petición concurrente lo inscribió primero (índice único)
+            session.rollback()
+            flash('Este estudiante ya está inscrito en esa materia.', 'danger')
 
     return redirect(url_for('detalle_inscripcion_estudiante', estudiante_id=estudiante_id))
 
 @app.route('/inscripciones/anular/<int:inscripcion_id>', methods=['POST'])
 def anular_inscripcion(inscripcion_id):
-    """Elimina un registro de inscripción (y sus asistencias en cascada)."""
+    """Elimina un registro de inscripción y sus asistencias."""
     inscripcion = session.query(Inscripcion).get(inscripcion_id)
     if inscripcion:
         # Guardamos el ID del estudiante para poder redirigir correctamente
         estudiante_id = inscripcion.estudiante_id
-        session.delete(inscripcion)
+        registrar_cambio_inscripciones(session, BAJA, Inscripcion.id == inscripcion_id)
+        borrar_inscripciones(session, Inscripcion.id == inscripcion_id)
         session.commit()
         flash('Inscripción anulada con éxito. Se ha eliminado el historial de asistencia asociado.', 'warning')
         return redirect(url_for('detalle_inscripcion_estudiante', estudiante_id=estudiante_id))
@@ -368,8 +778,8 @@ def modificar_asistencia(asistencia_id):
     """Actualiza el estado de un registro de asistencia (presente/ausente)."""
     asistencia = session.query(Asistencia).get(asistencia_id)
     if asistencia:
-        # Invertir el estado actual
-        asistencia.presente = not asistencia.presente
+        # Invertir el estado actual (y sus contadores, en la misma transacción)
+        alternar_asistencia(session, asistencia)
         session.commit()
         flash(f"Se actualizó la asistencia del estudiante {asistencia.inscripcion.estudiante.nombre} para la fecha {asistencia.fecha.strftime('%d-%m-%Y')}.", 'success')
         
@@ -381,5 +791,138 @@ def modificar_asistencia(asistencia_id):
     return redirect(url_for('index'))
 
 
+# --- REPORTE DE ESTUDIANTES EN RIESGO ---
+
+@app.route('/reportes/riesgo')
+def reporte_riesgo():
+    """Inscripciones por debajo del umbral, desde la tabla precalculada (JSON con ?formato=json)."""
+    materia_id = request.args.get('materia_id', type=int)
+    pagina = max(request.args.get('pagina', 1, type=int), 1)
+    filas, hay_mas = consultar_reporte(session, materia_id=materia_id, pagina=pagina)
+    estado = session.get(EstadoTrabajo, TRABAJO_REPORTE)
+    ejecutado = estado.ejecutado if estado else None
+    if request.args.get('formato') == 'json':
+        return jsonify({
+            'filas': filas,
+            'pagina': pagina,
+            'hay_mas': hay_mas,
+            'actualizado': ejecutado.isoformat() if ejecutado else None,
+        })
+    return render_template(
+        'reporte_riesgo.html', filas=filas, pagina=pagina, hay_mas=hay_mas, ejecutado=ejecutado,
+        materia_id=materia_id, materias=cache.obtener('materias:gestion', lambda: listado_materias(session, ordenar=True)),
+    )
+
+@app.route('/reportes/riesgo/umbrales', methods=['GET', 'POST'])
+def umbrales_riesgo():
+    """Umbral de asistencia por materia; en blanco, se usa el umbral por defecto."""
+    materias = session.execute(
+        select(Materia.id, Materia.nombre_materia, Materia.codigo_materia, UmbralAsistencia.umbral)
+        .outerjoin(UmbralAsistencia, UmbralAsistencia.materia_id == Materia.id)
+        .order_by(Materia.nombre_materia)
+    ).all()
+    if request.method == 'POST':
+        umbrales = {}
+        for materia in materias:
+            valor = request.form.get(f'umbral_{materia.id}', '').strip()
+            if not valor:
+                umbrales[materia.id] = None
+                continue
+            try:
+                umbral = float(valor)
+            except ValueError:
+                umbral = -1
+            if not 0 <= umbral <= 100:
+                flash(f'Umbral inválido para {materia.nombre_materia}: debe estar entre 0 y 100.', 'danger')
+                return redirect(url_for('umbrales_riesgo'))
+            umbrales[materia.id] = umbral
+        guardar_umbrales(session, umbrales)
+        session.commit()
+        flash('Umbrales guardados; el reporte se actualizará en su próxima ejecución.', 'success')
+        return redirect(url_for('umbrales_riesgo'))
+    return render_template('umbrales.html', materias=materias, umbral_defecto=UMBRAL_POR_DEFECTO)
+
+
+# --- COMANDOS DE MANTENIMIENTO (flask --app app <comando>) ---
+
+@app.cli.command('reconstruir-resumen')
+@click.option('--verificar', is_flag=True, help='Solo compara los contadores, sin modificarlos.')
+def reconstruir_resumen_comando(verificar):
+    """Recalcula los contadores de asistencia desde la tabla asistencias."""
+    diferencias = reconstruir_resumen(session, solo_verificar=verificar)
+    session.commit()
+    for diferencia in diferencias:
+        click.echo(f"Inscripción {diferencia.inscripcion_id}: guardado {diferencia.guardado}, real {diferencia.real}")
+    if not diferencias:
+        click.echo('Los contadores coinciden con los datos de asistencia.')
+    elif verificar:
+        click.echo(f'{len(diferencias)} inscripción(es) con contadores incorrectos.')
+    else:
+        click.echo(f'{len(diferencias)} inscripción(es) corregidas.')
+
+
+@app.cli.command('importar')
+@click.argument('tipo', type=click.Choice(sorted(IMPORTADORES)))
+@click.argument('archivo', type=click.Path(exists=True, dir_okay=False))
+def importar_comando(tipo, archivo):
+    """Importa estudiantes, materias o inscripciones desde un archivo CSV."""
+    with open(archivo, encoding='utf-8-sig', newline='') as texto:
+        resultado = importar_csv(session, tipo, texto)
+    cache.invalidar(tipo)
+    for error in resultado.errores:
+        click.echo(f"Línea {error.linea}: {error.mensaje}")
+    click.echo(f'{resultado.insertados} registro(s) importado(s), {len(resultado.errores)} error(es).')
+
+
+@app.cli.command('archivar')
+@click.option('--hasta', required=True, type=click.DateTime(formats=['%Y-%m-%d']),
+              help='Última fecha (incluida) del periodo cerrado.')
+@click.option('--compactar', is_flag=True, help='Ejecuta VACUUM al terminar para reducir el archivo.')
+def archivar_comando(hasta, compactar):
+    """Mueve las asistencias hasta una fecha al archivo comprimido por inscripción."""
+    try:
+        periodo = archivar(session, hasta.date())
+    except ValueError as error:
+        raise click.ClickException(str(error))
+    incrementar_versiones(session, 'archivo')
+    session.commit()
+    click.echo(f'{periodo.registros} registro(s) archivado(s) del {periodo.desde:%d-%m-%Y} al {periodo.hasta:%d-%m-%Y}.')
+    if compactar:
+        session.remove()
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.exec_driver_sql('VACUUM')
+        click.echo('Base de datos compactada.')
+
+
+@app.cli.command('procesar-cola')
+@click.option('--una-vez', is_flag=True, help='Aplica lo pendiente y termina.')
+def procesar_cola_comando(una_vez):
+    """Escritor dedicado de la cola de asistencia (con ASISTENCIA_COLA_HILO=0 en los workers)."""
+    if cola is None:
+        raise click.ClickException('La cola no está activa (ASISTENCIA_COLA=1).')
+    ejecutar_escritor(cola, session, una_vez=una_vez)
+    click.echo(f"Pendientes: {cola.estado()['pendientes']}")
+
+
+@app.cli.command('reporte-riesgo')
+@click.option('--completo', is_flag=True, help='Recalcula todas las inscripciones, no solo las modificadas.')
+def reporte_riesgo_comando(completo):
+    """Actualiza el reporte de estudiantes en riesgo (pensado para cron)."""
+    resultado = actualizar_reporte(session, completo=completo)
+    session.commit()
+    if resultado.completo:
+        click.echo(f'Reporte recalculado por completo hasta el cambio {resultado.cursor}.')
+    else:
+        click.echo(f'Reporte actualizado hasta el cambio {resultado.cursor}: {resultado.inscripciones} inscripción(es) '
+                   f'y {resultado.materias} materia(s) con umbral nuevo recalculadas.')
+
+
+@app.cli.command('purgar')
+def purgar_comando():
+    """Completa las purgas pendientes de materias eliminadas (p. ej. tras reiniciar)."""
+    ejecutar_purgas(session)
+    click.echo('No quedan purgas pendientes.')
+
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
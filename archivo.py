@@ -0,0 +1,152 @@
+# archivo.py
+# Archivo de periodos cerrados. `flask archivar --hasta AAAA-MM-DD` mueve los
+# registros de asistencias hasta esa fecha a asistencias_archivadas: una fila
+# por inscripción y periodo con dos mapas de bits indexados por día (días con
+# registro y días presente) en lugar de una fila por estudiante y clase. La
+# tabla asistencias conserva solo el periodo en curso.
+#
+# Los contadores de resumen_asistencias no cambian al archivar (ya incluyen
+# los registros archivados). El historial, la matriz y las exportaciones
+# combinan los datos vivos con los archivados; las fechas archivadas no admiten
+# escrituras.
+import datetime
+import heapq
+from collections import namedtuple
+from itertools import groupby
+from sqlalchemy import String, delete, func, insert, select, type_coerce
+from models import Asistencia, AsistenciaArchivada, Inscripcion, PeriodoArchivado
+
+# Filas archivadas por sentencia INSERT y filas leídas por lote al archivar
+TAMANO_LOTE_ARCHIVO = 5000
+
+# Registro archivado con la misma forma que usa la plantilla del historial
+RegistroArchivado = namedtuple('RegistroArchivado', ['fecha', 'presente', 'inscripcion', 'archivado'])
+
+
+class FechaArchivada(ValueError):
+    """Se intentó escribir asistencia en una fecha de un periodo archivado."""
+
+
+def codificar(fecha_inicio, registros):
+    """Convierte [(fecha, presente)] en los mapas de bits (sesiones, presentes)."""
+    sesiones = presentes = 0
+    ultimo = 0
+    for fecha, presente in registros:
+        dia = (fecha - fecha_inicio).days
+        sesiones |= 1 << dia
+        if presente:
+            presentes |= 1 << dia
+        ultimo = max(ultimo, dia)
+    longitud = ultimo // 8 + 1
+    return sesiones.to_bytes(longitud, 'little'), presentes.to_bytes(longitud, 'little')
+
+
+def decodificar(fecha_inicio, sesiones, presentes, descendente=False):
+    """Genera (fecha, presente) en orden de fecha a partir de los mapas de bits."""
+    sesiones = int.from_bytes(sesiones, 'little')
+    presentes = int.from_bytes(presentes, 'little')
+    while sesiones:
+        bit = 1 << (sesiones.bit_length() - 1) if descendente else sesiones & -sesiones
+        yield fecha_inicio + datetime.timedelta(days=bit.bit_length() - 1), bool(presentes & bit)
+        sesiones ^= bit
+
+
+def fecha_limite_archivo(session):
+    """Última fecha archivada (None si no hay nada archivado)."""
+    return session.scalar(select(func.max(PeriodoArchivado.hasta)))
+
+
+def comprobar_fechas(session, fechas):
+    """Lanza FechaArchivada si alguna de las fechas pertenece a un periodo archivado."""
+    limite = fecha_limite_archivo(session)
+    if limite is not None and fechas and min(fechas) <= limite:
+        raise FechaArchivada(f'Las fechas hasta el {limite:%d-%m-%Y} están archivadas y no se pueden modificar.')
+
+
+def archivar(session, hasta):
+    """Mueve los registros con fecha <= 'hasta' a asistencias_archivadas.
+
+    No hace commit. Devuelve el PeriodoArchivado creado.
+    """
+    limite = fecha_limite_archivo(session)
+    if limite is not None and hasta <= limite:
+        raise ValueError(f'Ya está archivado hasta el {limite:%d-%m-%Y}.')
+
+    # Recorrido por el índice único (inscripcion_id, fecha): los registros de
+    # cada inscripción llegan juntos y ordenados por fecha
+    resultado = session.connection().execution_options(yield_per=TAMANO_LOTE_ARCHIVO).execute(
+        select(Asistencia.inscripcion_id, type_coerce(Asistencia.fecha, String), Asistencia.presente)
+        .where(Asistencia.fecha <= hasta, Asistencia.inscripcion_id.isnot(None))
+        .order_by(Asistencia.inscripcion_id, Asistencia.fecha)
+    )
+    total = 0
+    desde = hasta
+    filas = []
+    for inscripcion_id, grupo in groupby(resultado, key=lambda fila: fila[0]):
+        registros = [
+            (datetime.date.fromisoformat(fecha) if isinstance(fecha, str) else fecha, presente)
+            for _, fecha, presente in grupo
+        ]
+        fecha_inicio = registros[0][0]
+        sesiones, presentes = codificar(fecha_inicio, registros)
+        filas.append({
+            'inscripcion_id': inscripcion_id, 'fecha_inicio': fecha_inicio, 'fecha_fin': registros[-1][0],
+            'total_clases': len(registros), 'clases_presente': sum(1 for _, presente in registros if presente),
+            'sesiones': sesiones, 'presentes': presentes,
+        })
+        total += len(registros)
+        desde = min(desde, fecha_inicio)
+        if len(filas) >= TAMANO_LOTE_ARCHIVO:
+            session.execute(insert(AsistenciaArchivada), filas)
+            filas = []
+    if filas:
+        session.execute(insert(AsistenciaArchivada), filas)
+
+    session.execute(
+        delete(Asistencia).where(Asistencia.fecha <= hasta).execution_options(synchronize_session=False)
+    )
+    periodo = PeriodoArchivado(desde=desde, hasta=hasta, registros=total)
+    session.add(periodo)
+    session.flush()
+    return periodo
+
+
+def consulta_archivada(*columnas):
+    """SELECT base de los registros archivados, unido a inscripciones.
+
+    Las cuatro primeras columnas son las que necesita registros_archivados();
+    'columnas' se añaden al final de cada registro generado.
+    """
+    return select(
+        AsistenciaArchivada.inscripcion_id, AsistenciaArchivada.fecha_inicio,
+        AsistenciaArchivada.sesiones, AsistenciaArchivada.presentes, *columnas,
+    ).join(Inscripcion, Inscripcion.id == AsistenciaArchivada.inscripcion_id)
+
+
+def registros_archivados(session, consulta, desde=None, hasta=None, descendente=False):
+    """Genera (fecha, inscripcion_id, presente, *columnas) ordenados por fecha e inscripción.
+
+    Se lee un periodo archivado cada vez y sus filas se expanden con
+    heapq.merge (cada fila ya está ordenada por fecha), así que la memoria
+    depende del número de inscripciones del periodo y no del de registros.
+    Con descendente=True se recorre desde el final: quien pare tras unos pocos
+    registros solo lee el último periodo y decodifica unos días de cada fila.
+    """
+    orden = PeriodoArchivado.hasta.desc() if descendente else PeriodoArchivado.hasta
+    periodos = session.execute(select(PeriodoArchivado.desde, PeriodoArchivado.hasta).order_by(orden)).all()
+    for periodo_desde, periodo_hasta in periodos:
+        if (desde is not None and periodo_hasta < desde) or (hasta is not None and periodo_desde > hasta):
+            continue
+        filtro = [AsistenciaArchivada.fecha_inicio.between(periodo_desde, periodo_hasta)]
+        if desde is not None:
+            filtro.append(AsistenciaArchivada.fecha_fin >= desde)
+        if hasta is not None:
+            filtro.append(AsistenciaArchivada.fecha_inicio <= hasta)
+        filas = session.execute(consulta.where(*filtro)).all()
+
+        def secuencia(fila):
+            for fecha, presente in decodificar(fila[1], fila[2], fila[3], descendente):
+                if (desde is None or fecha >= desde) and (hasta is None or fecha <= hasta):
+                    yield (fecha, fila[0], presente, *fila[4:])
+
+        yield from heapq.merge(*(secuencia(fila) for fila in filas), reverse=descendente)
@@ -0,0 +1,124 @@
+# benchmark.py
+# Mide las rutas principales con el cliente de pruebas de Flask sobre una base
+# de datos generada con generar_datos.py, y muestra percentiles de latencia y
+# número de consultas SQL por ruta. Uso:
+#
+#   python benchmark.py --db bench.db --iteraciones 50
+#
+# La ruta registrar_asistencia escribe en la base de datos indicada. Por defecto
+# la caché de listados y páginas está desactivada, para medir el trabajo real de
+# cada ruta; con --cache memoria se miden las ejecuciones en caliente.
+import argparse
+import datetime
+import json
+import os
+import random
+import statistics
+import time
+
+
+def _argumentos():
+    parser = argparse.ArgumentParser(description='Benchmark de las rutas principales.')
+    parser.add_argument('--db', required=True, help='Archivo SQLite generado con generar_datos.py.')
+    parser.add_argument('--iteraciones', type=int, default=30, help='Peticiones por ruta.')
+    parser.add_argument('--rutas', nargs='*', help='Medir solo estas rutas (nombre del endpoint).')
+    parser.add_argument('--semilla', type=int, default=42)
+    parser.add_argument('--cache', choices=['desactivada', 'memoria'], default='desactivada',
+                        help='Backend de caché de la aplicación (memoria: medir aciertos de caché).')
+    parser.add_argument('--json', action='store_true', help='Imprime los resultados en JSON.')
+    return parser.parse_args()
+
+
+def percentil(valores, p):
+    """Percentil p (0-100) por el método del rango más cercano."""
+    ordenados = sorted(valores)
+    indice = max(0, min(len(ordenados) - 1, round(p / 100 * len(ordenados) + 0.5) - 1))
+    return ordenados[indice]
+
+
+def _escenarios(session, azar):
+    """Devuelve {endpoint: función(cliente) -> respuesta} con parámetros de ejemplo."""
+    from sqlalchemy import select
+    from models import Estudiante, Inscripcion, Materia
+
+    materias = session.scalars(select(Materia.id)).all()
+    estudiantes = session.scalars(select(Estudiante.id)).all()
+    # Listas de inscritos por materia, leídas de antemano para no contar sus consultas
+    inscritos = {}
+    for materia_id, inscripcion_id in session.execute(select(Inscripcion.materia_id, Inscripcion.id)):
+        inscritos.setdefault(materia_id, []).append(inscripcion_id)
+    hoy = datetime.date.today().isoformat()
+
+    def registrar(cliente):
+        materia_id = azar.choice(materias)
+        presentes = [str(i) for i in inscritos.get(materia_id, []) if azar.random() < 0.8]
+        return cliente.post('/registrar_asistencia', data={'materia_id': materia_id, 'fecha': hoy, 'presente': presentes})
+
+    return {
+        'index': lambda c: c.get('/'),
+        'materia_detalle': lambda c: c.get(f'/materia/{azar.choice(materias)}'),
+        'registrar_asistencia': registrar,
+        'ver_asistencias': lambda c: c.get(f'/asistencias/{azar.choice(materias)}'),
+        'detalle_inscripcion_estudiante': lambda c: c.get(f'/inscripciones/estudiante/{azar.choice(estudiantes)}'),
+    }
+
+
+def medir(args):
+    # La URL y la caché deben fijarse antes de importar la aplicación (se configuran al importarla)
+    if not os.path.exists(args.db):
+        raise SystemExit(f'No existe {args.db}; créalo primero con generar_datos.py.')
+    os.environ['ASISTENCIA_DATABASE_URL'] = f'sqlite:///{os.path.abspath(args.db)}'
+    os.environ['ASISTENCIA_CACHE'] = args.cache
+    from sqlalchemy import event
+    from app import app
+    from models import DBSession, engine
+
+    consultas = [0]
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def contar(*_):
+        consultas[0] += 1
+
+    azar = random.Random(args.semilla)
+    preparacion = DBSession()
+    escenarios = _escenarios(preparacion, azar)
+    cliente = app.test_client()
+
+    resultados = {}
+    for endpoint, peticion in escenarios.items():
+        if args.rutas and endpoint not in args.rutas:
+            continue
+        peticion(cliente)  # calentamiento (caché de plantillas, conexiones del pool)
+        tiempos, conteos = [], []
+        for _ in range(args.iteraciones):
+            consultas[0] = 0
+            inicio = time.perf_counter()
+            respuesta = peticion(cliente)
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+            conteos.append(consultas[0])
+            if respuesta.status_code >= 400:
+                raise SystemExit(f'{endpoint} respondió {respuesta.status_code}')
+        resultados[endpoint] = {
+            'p50_ms': round(percentil(tiempos, 50), 2),
+            'p95_ms': round(percentil(tiempos, 95), 2),
+            'p99_ms': round(percentil(tiempos, 99), 2),
+            'max_ms': round(max(tiempos), 2),
+            'consultas': round(statistics.mean(conteos), 1),
+        }
+    preparacion.close()
+    return resultados
+
+
+def imprimir(resultados):
+    print(f"{'Ruta':<32}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'consultas':>11}")
+    for endpoint, r in resultados.items():
+        print(f"{endpoint:<32}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}{r['max_ms']:>10}{r['consultas']:>11}")
+
+
+if __name__ == '__main__':
+    args = _argumentos()
+    resultados = medir(args)
+    if args.json:
+        print(json.dumps(resultados, indent=2))
+    else:
+        imprimir(resultados)
@@ -0,0 +1,147 @@
+# cache.py
+# Caché de lectura para los listados de referencia (materias, profesores,
+# estudiantes), que cambian pocas veces por semestre. Los valores guardados son
+# datos simples (listas de diccionarios), nunca objetos del ORM ligados a una
+# sesión. Las rutas que modifican datos invalidan por prefijo tras el commit.
+#
+# Backends (variable ASISTENCIA_CACHE):
+#   memoria     - diccionario LRU con TTL en cada proceso (por defecto)
+#   sqlite      - archivo SQLite local compartido por todos los workers
+#                 (ASISTENCIA_CACHE_ARCHIVO), para que una invalidación en un
+#                 worker se vea en los demás
+#   desactivada - sin caché
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_BACKEND = os.environ.get('ASISTENCIA_CACHE', 'memoria')
+CACHE_TTL = float(os.environ.get('ASISTENCIA_CACHE_TTL', 300))
+CACHE_MAX_ENTRADAS = int(os.environ.get('ASISTENCIA_CACHE_MAX', 1000))
+CACHE_ARCHIVO = os.environ.get('ASISTENCIA_CACHE_ARCHIVO', 'cache.db')
+
+_AUSENTE = object()
+
+
+class BackendMemoria:
+    """LRU acotado a 'max_entradas', con caducidad por entrada."""
+
+    def __init__(self, max_entradas=CACHE_MAX_ENTRADAS):
+        self.max_entradas = max_entradas
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                return _AUSENTE
+            expira, valor = entrada
+            if expira < time.monotonic():
+                del self._datos[clave]
+                return _AUSENTE
+            self._datos.move_to_end(clave)
+            return valor
+
+    def guardar(self, clave, valor, ttl):
+        with self._lock:
+            self._datos[clave] = (time.monotonic() + ttl, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+    def invalidar(self, prefijo):
+        with self._lock:
+            for clave in [c for c in self._datos if c.startswith(prefijo)]:
+                del self._datos[clave]
+
+
+class BackendSQLite:
+    """Caché en un archivo SQLite local, compartido entre procesos."""
+
+    def __init__(self, archivo=CACHE_ARCHIVO, max_entradas=CACHE_MAX_ENTRADAS):
+        self.archivo = archivo
+        self.max_entradas = max_entradas
+        self._local = threading.local()
+        with self._conexion() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                'clave TEXT PRIMARY KEY, valor BLOB NOT NULL, expira REAL NOT NULL, guardado REAL NOT NULL)'
+            )
+
+    def _conexion(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.archivo, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            self._local.conn = conn
+        return conn
+
+    def obtener(self, clave):
+        conn = self._conexion()
+        ahora = time.time()
+        fila = conn.execute('SELECT valor FROM cache WHERE clave = ? AND expira > ?', (clave, ahora)).fetchone()
+        if fila is None:
+            return _AUSENTE
+        return pickle.loads(fila[0])
+
+    def guardar(self, clave, valor, ttl):
+        ahora = time.time()
+        with self._conexion() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO cache (clave, valor, expira, guardado) VALUES (?, ?, ?, ?)',
+                (clave, pickle.dumps(valor, pickle.HIGHEST_PROTOCOL), ahora + ttl, ahora),
+            )
+            # Se descartan las caducadas y, si sobran, las guardadas hace más tiempo
+            # (las lecturas no escriben, para no competir por el bloqueo de escritura)
+            conn.execute('DELETE FROM cache WHERE expira <= ?', (ahora,))
+            conn.execute(
+                'DELETE FROM cache WHERE clave IN (SELECT clave FROM cache ORDER BY guardado DESC LIMIT -1 OFFSET ?)',
+                (self.max_entradas,),
+            )
+
+    def invalidar(self, prefijo):
+        with self._conexion() as conn:
+            conn.execute("DELETE FROM cache WHERE substr(clave, 1, ?) = ?", (len(prefijo), prefijo))
+
+
+class BackendNulo:
+    def obtener(self, clave):
+        return _AUSENTE
+
+    def guardar(self, clave, valor, ttl):
+        pass
+
+    def invalidar(self, prefijo):
+        pass
+
+
+class Cache:
+    """Caché de lectura: obtener() devuelve el valor guardado o lo calcula y guarda."""
+
+    def __init__(self, backend, ttl=CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+
+    def obtener(self, clave, calcular, ttl=None):
+        valor = self.backend.obtener(clave)
+        if valor is _AUSENTE:
+            valor = calcular()
+            self.backend.guardar(clave, valor, self.ttl if ttl is None else ttl)
+        return valor
+
+    def invalidar(self, *prefijos):
+        """Elimina las entradas cuyas claves empiezan por alguno de los prefijos."""
+        for prefijo in prefijos:
+            self.backend.invalidar(prefijo)
+
+
+def crear_cache():
+    backends = {'memoria': BackendMemoria, 'sqlite': BackendSQLite, 'desactivada': BackendNulo}
+    return Cache(backends[CACHE_BACKEND]())
+
+
+cache = crear_cache()
@@ -0,0 +1,191 @@
+# cola_asistencia.py
+# Modo opcional de ingesta diferida para registrar_asistencia. Cada envío se
+# valida, se guarda en una cola local y duradera (un archivo SQLite aparte, así
+# no compite por el bloqueo de escritura de la base principal) y se confirma al
+# profesor de inmediato. Un escritor en segundo plano aplica los envíos
+# pendientes por grupos: muchos envíos por transacción, con "el último gana"
+# para cada (inscripcion_id, fecha).
+#
+# Solo un escritor aplica la cola a la vez, aunque haya varios workers: se
+# coordina con una cesión (lease) con caducidad guardada en la propia cola.
+# Cada escritor (hilo o `flask procesar-cola`) tiene su propio titular, aunque
+# compartan la instancia de ColaAsistencia.
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from archivo import fecha_limite_archivo
+from servicios import registrar_hojas
+
+COLA_ACTIVA = os.environ.get('ASISTENCIA_COLA') == '1'
+# Arrancar el escritor como hilo dentro de cada worker (si no, usar `flask procesar-cola`)
+COLA_HILO = os.environ.get('ASISTENCIA_COLA_HILO', '1') == '1'
+COLA_ARCHIVO = os.environ.get('ASISTENCIA_COLA_ARCHIVO', 'cola_asistencia.db')
+# Envíos que se aplican como máximo en una transacción
+TAMANO_GRUPO = 500
+# Segundos entre pasadas del escritor cuando la cola está vacía
+INTERVALO_ESCRITOR = 0.5
+# Duración de la cesión del escritor; se renueva en cada pasada
+DURACION_CESION = 30
+# Los envíos aplicados se conservan este tiempo (para el estado) y luego se borran
+RETENCION_APLICADOS = 24 * 3600
+
+_hilo = None
+_lock_hilo = threading.Lock()
+
+
+class ColaAsistencia:
+    """Cola duradera de envíos de asistencia en un archivo SQLite local."""
+
+    def __init__(self, archivo=COLA_ARCHIVO):
+        self.archivo = archivo
+        self._local = threading.local()
+        with self._conexion() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS envios (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    materia_id INTEGER NOT NULL,
+                    fecha TEXT NOT NULL,
+                    presentes TEXT NOT NULL,
+                    recibido REAL NOT NULL,
+                    aplicado REAL
+                );
+                CREATE INDEX IF NOT EXISTS ix_envios_aplicado ON envios (aplicado, id);
+                CREATE TABLE IF NOT EXISTS cesion (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    titular TEXT,
+                    expira REAL NOT NULL
+                );
+                INSERT OR IGNORE INTO cesion (id, titular, expira) VALUES (1, NULL, 0);
+            """)
+
+    def _conexion(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.archivo, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # El envío ya se confirmó al profesor: no se puede perder
+            conn.execute('PRAGMA synchronous=FULL')
+            self._local.conn = conn
+        return conn
+
+    def encolar(self, materia_id, fecha, presentes_ids):
+        """Guarda un envío y devuelve su id."""
+        with self._conexion() as conn:
+            cursor = conn.execute(
+                'INSERT INTO envios (materia_id, fecha, presentes, recibido) VALUES (?, ?, ?, ?)',
+                (materia_id, fecha.isoformat(), json.dumps(sorted(set(presentes_ids))), time.time()),
+            )
+            return cursor.lastrowid
+
+    def _tomar_cesion(self, titular):
+        ahora = time.time()
+        with self._conexion() as conn:
+            cursor = conn.execute(
+                'UPDATE cesion SET titular = ?, expira = ? WHERE id = 1 AND (titular = ? OR expira < ?)',
+                (titular, ahora + DURACION_CESION, titular, ahora),
+            )
+            return cursor.rowcount == 1
+
+    def procesar_pendientes(self, session, titular, maximo=TAMANO_GRUPO):
+        """Aplica hasta 'maximo' envíos pendientes en una transacción; devuelve cuántos aplicó.
+
+        Solo si 'titular' tiene (o puede tomar) la cesión del escritor.
+        """
+        if not self._tomar_cesion(titular):
+            return 0
+        conn = self._conexion()
+        envios = conn.execute(
+            'SELECT id, materia_id, fecha, presentes FROM envios WHERE aplicado IS NULL ORDER BY id LIMIT ?',
+            (maximo,),
+        ).fetchall()
+        if not envios:
+            return 0
+
+        # En orden de llegada: un envío posterior sobrescribe al anterior. Los
+        # envíos de fechas archivadas después de recibirlos ya no se pueden aplicar.
+        limite_archivo = fecha_limite_archivo(session)
+        hojas = [
+            (materia_id, datetime.date.fromisoformat(fecha), json.loads(presentes))
+            for _, materia_id, fecha, presentes in envios
+        ]
+        registrar_hojas(session, [
+            hoja for hoja in hojas if limite_archivo is None or hoja[1] > limite_archivo
+        ])
+        session.commit()
+
+        # Si el proceso cae antes de marcarlos, se reaplican: el upsert es idempotente
+        ahora = time.time()
+        with conn:
+            conn.executemany('UPDATE envios SET aplicado = ? WHERE id = ?', [(ahora, envio[0]) for envio in envios])
+            conn.execute('DELETE FROM envios WHERE aplicado < ?', (ahora - RETENCION_APLICADOS,))
+        return len(envios)
+
+    def estado(self):
+        """Profundidad de la cola y retraso de aplicación, para el endpoint de estado."""
+        conn = self._conexion()
+        ahora = time.time()
+        pendientes, mas_antiguo = conn.execute(
+            'SELECT COUNT(*), MIN(recibido) FROM envios WHERE aplicado IS NULL'
+        ).fetchone()
+        ultimo = conn.execute(
+            'SELECT aplicado, aplicado - recibido FROM envios WHERE aplicado IS NOT NULL ORDER BY aplicado DESC, id DESC LIMIT 1'
+        ).fetchone()
+        retraso_hora = conn.execute(
+            'SELECT COUNT(*), AVG(aplicado - recibido), MAX(aplicado - recibido) FROM envios WHERE aplicado >= ?',
+            (ahora - 3600,),
+        ).fetchone()
+        titular, expira = conn.execute('SELECT titular, expira FROM cesion WHERE id = 1').fetchone()
+        return {
+            'pendientes': pendientes,
+            'antiguedad_pendiente_s': round(ahora - mas_antiguo, 3) if mas_antiguo else 0,
+            'ultimo_aplicado': datetime.datetime.fromtimestamp(ultimo[0]).isoformat() if ultimo else None,
+            'retraso_ultimo_s': round(ultimo[1], 3) if ultimo else None,
+            'aplicados_ultima_hora': retraso_hora[0],
+            'retraso_medio_ultima_hora_s': round(retraso_hora[1], 3) if retraso_hora[1] is not None else None,
+            'retraso_maximo_ultima_hora_s': round(retraso_hora[2], 3) if retraso_hora[2] is not None else None,
+            'escritor_activo': expira > ahora,
+        }
+
+
+def ejecutar_escritor(cola, session, detener=None, una_vez=False, titular=None):
+    """Bucle del escritor: aplica grupos mientras haya pendientes y luego espera."""
+    titular = titular or uuid.uuid4().hex
+    while detener is None or not detener.is_set():
+        try:
+            aplicados = cola.procesar_pendientes(session, titular)
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.remove()
+        if una_vez and not aplicados:
+            return
+        if not aplicados:
+            time.sleep(INTERVALO_ESCRITOR)
+
+
+def iniciar_escritor(app, cola, session):
+    """Arranca el escritor como hilo daemon, si no hay ya uno en este proceso.
+
+    Los errores se registran y se reintenta con el mismo titular, que conserva la cesión.
+    """
+    global _hilo
+    titular = uuid.uuid4().hex
+
+    def bucle():
+        while True:
+            try:
+                ejecutar_escritor(cola, session, titular=titular)
+            except Exception:
+                app.logger.exception('Error aplicando la cola de asistencia; se reintentará.')
+                time.sleep(DURACION_CESION / 10)
+
+    with _lock_hilo:
+        if _hilo is None or not _hilo.is_alive():
+            _hilo = threading.Thread(target=bucle, name='escritor-cola-asistencia', daemon=True)
+            _hilo.start()
+    return _hilo
@@ -0,0 +1,204 @@
+# database_migrate.py
+# Actualiza una base de datos existente al esquema actual SIN borrar datos
+# (a diferencia de database_setup.py). Cada paso se aplica una sola vez y la
+# versión aplicada se guarda en PRAGMA user_version.
+from sqlalchemy.exc import OperationalError
+from models import (
+    Asistencia, AsistenciaArchivada, Cambio, EstadoTrabajo, Inscripcion, PeriodoArchivado, Purga,
+    ReporteRiesgo, ResumenAsistencia, UmbralAsistencia, VersionDatos, engine,
+)
+
+
+_INDICES_V1 = {
+    'ux_inscripciones_estudiante_materia', 'ix_inscripciones_materia_id',
+    'ux_asistencias_inscripcion_fecha', 'ix_asistencias_fecha',
+}
+
+
+def _v1_indices_y_unicidad(conn):
+    """Elimina duplicados y crea los índices únicos de inscripciones y asistencias."""
+    # 1. Fusionar inscripciones duplicadas (mismo estudiante y materia) en la más antigua
+    conn.exec_driver_sql("""
+        CREATE TEMP TABLE _inscripciones_duplicadas AS
+        SELECT i.id AS id, k.conservar AS conservar
+        FROM inscripciones i
+        JOIN (
+            SELECT estudiante_id, materia_id, MIN(id) AS conservar
+            FROM inscripciones
+            WHERE estudiante_id IS NOT NULL AND materia_id IS NOT NULL
+            GROUP BY estudiante_id, materia_id
+            HAVING COUNT(*) > 1
+        ) k ON k.estudiante_id = i.estudiante_id AND k.materia_id = i.materia_id
+        WHERE i.id <> k.conservar
+    """)
+    conn.exec_driver_sql("""
+        UPDATE asistencias
+        SET inscripcion_id = (SELECT conservar FROM _inscripciones_duplicadas d
+                              WHERE d.id = asistencias.inscripcion_id)
+        WHERE inscripcion_id IN (SELECT id FROM _inscripciones_duplicadas)
+    """)
+    conn.exec_driver_sql("DELETE FROM inscripciones WHERE id IN (SELECT id FROM _inscripciones_duplicadas)")
+    conn.exec_driver_sql("DROP TABLE _inscripciones_duplicadas")
+
+    # 2. Deduplicar asistencias: se conserva el registro más reciente de cada (inscripción, fecha)
+    conn.exec_driver_sql("""
+        DELETE FROM asistencias
+        WHERE id NOT IN (SELECT MAX(id) FROM asistencias GROUP BY inscripcion_id, fecha)
+    """)
+
+    # 3. Crear los índices declarados en models.py (solo los de esta versión:
+    # los posteriores pueden depender de columnas que aún no existen)
+    for tabla in (Inscripcion.__table__, Asistencia.__table__):
+        for indice in tabla.indexes:
+            if indice.name in _INDICES_V1:
+                indice.create(conn, checkfirst=True)
+
+
+def _v2_resumen_asistencias(conn):
+    """Crea la tabla de contadores y la llena desde las asistencias existentes."""
+    ResumenAsistencia.__table__.create(conn, checkfirst=True)
+    conn.exec_driver_sql("DELETE FROM resumen_asistencias")
+    conn.exec_driver_sql("""
+        INSERT INTO resumen_asistencias (inscripcion_id, total_clases, clases_presente, ultima_fecha)
+        SELECT inscripcion_id, COUNT(*), SUM(CASE WHEN presente THEN 1 ELSE 0 END), MAX(fecha)
+        FROM asistencias
+        WHERE inscripcion_id IS NOT NULL
+        GROUP BY inscripcion_id
+    """)
+
+
+def _v3_registro_de_cambios(conn):
+    """Crea el registro de cambios y la columna asistencias.version para la sincronización."""
+    columnas = [fila[1] for fila in conn.exec_driver_sql('PRAGMA table_info(asistencias)')]
+    if 'version' not in columnas:
+        conn.exec_driver_sql('ALTER TABLE asistencias ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+    for indice in Asistencia.__table__.indexes:
+        indice.create(conn, checkfirst=True)
+    Cambio.__table__.create(conn, checkfirst=True)
+    # Las inscripciones existentes se anotan como altas para la primera sincronización
+    conn.exec_driver_sql("""
+        INSERT INTO cambios (entidad, entidad_id, materia_id, operacion, fecha_hora)
+        SELECT 'inscripcion', id, materia_id, 'alta', datetime('now', 'localtime') FROM inscripciones ORDER BY id
+    """)
+
+
+def _v4_archivo(conn):
+    """Crea las tablas del archivo de periodos cerrados."""
+    AsistenciaArchivada.__table__.create(conn, checkfirst=True)
+    PeriodoArchivado.__table__.create(conn, checkfirst=True)
+
+
+def _v5_indice_busqueda(conn):
+    """Crea el índice de texto completo de estudiantes."""
+    crear_indice_busqueda(conn)
+
+
+def _v6_reporte_riesgo(conn):
+    """Crea las tablas del reporte de riesgo; se llena en la primera ejecución del trabajo."""
+    for modelo in (UmbralAsistencia, ReporteRiesgo, EstadoTrabajo):
+        modelo.__table__.create(conn, checkfirst=True)
+
+
+def _v7_purgas(conn):
+    """Crea la tabla de purgas y la columna inscripciones.purga_id."""
+    Purga.__table__.create(conn, checkfirst=True)
+    columnas = [fila[1] for fila in conn.exec_driver_sql('PRAGMA table_info(inscripciones)')]
+    if 'purga_id' not in columnas:
+        conn.exec_driver_sql('ALTER TABLE inscripciones ADD COLUMN purga_id INTEGER REFERENCES purgas (id)')
+    for indice in Inscripcion.__table__.indexes:
+        indice.create(conn, checkfirst=True)
+
+
+def _v8_versiones(conn):
+    """Crea la tabla de versiones de datos (las páginas empiezan en la versión 0)."""
+    VersionDatos.__table__.create(conn, checkfirst=True)
+
+
+# Lista ordenada de pasos: (versión, función). Añadir los nuevos al final.
+MIGRACIONES = [
+    (1, _v1_indices_y_unicidad),
+    (2, _v2_resumen_asistencias),
+    (3, _v3_registro_de_cambios),
+    (4, _v4_archivo),
+    (5, _v5_indice_busqueda),
+    (6, _v6_reporte_riesgo),
+    (7, _v7_purgas),
+    (8, _v8_versiones),
+]
+VERSION_ACTUAL = MIGRACIONES[-1][0]
+
+
+def crear_indice_busqueda(conn):
+    """Crea (o reconstruye) la tabla FTS5 de estudiantes y sus triggers de sincronización.
+
+    La tabla indexa nombre, apellido y código sin acentos; los triggers la
+    actualizan al crear, editar o borrar estudiantes (las bajas lógicas se
+    filtran con estudiantes.is_active). Devuelve False si SQLite no tiene FTS5:
+    la búsqueda usa entonces LIKE.
+    """
+    if conn.dialect.name != 'sqlite':
+        return False
+    try:
+        conn.exec_driver_sql("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS estudiantes_fts USING fts5(
+                nombre, apellido, codigo_estudiante,
+                content='estudiantes', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        """)
+    except OperationalError:
+        return False
+    conn.exec_driver_sql("""
+        CREATE TRIGGER IF NOT EXISTS estudiantes_fts_insertar AFTER INSERT ON estudiantes BEGIN
+            INSERT INTO estudiantes_fts (rowid, nombre, apellido, codigo_estudiante)
+            VALUES (new.id, new.nombre, new.apellido, new.codigo_estudiante);
+        END
+    """)
+    conn.exec_driver_sql("""
+        CREATE TRIGGER IF NOT EXISTS estudiantes_fts_borrar AFTER DELETE ON estudiantes BEGIN
+            INSERT INTO estudiantes_fts (estudiantes_fts, rowid, nombre, apellido, codigo_estudiante)
+            VALUES ('delete', old.id, old.nombre, old.apellido, old.codigo_estudiante);
+        END
+    """)
+    conn.exec_driver_sql("""
+        CREATE TRIGGER IF NOT EXISTS estudiantes_fts_editar
+        AFTER UPDATE OF nombre, apellido, codigo_estudiante ON estudiantes BEGIN
+            INSERT INTO estudiantes_fts (estudiantes_fts, rowid, nombre, apellido, codigo_estudiante)
+            VALUES ('delete', old.id, old.nombre, old.apellido, old.codigo_estudiante);
+            INSERT INTO estudiantes_fts (rowid, nombre, apellido, codigo_estudiante)
+            VALUES (new.id, new.nombre, new.apellido, new.codigo_estudiante);
+        END
+    """)
+    conn.exec_driver_sql("INSERT INTO estudiantes_fts (estudiantes_fts) VALUES ('rebuild')")
+    return True
+
+
+def version_esquema(conn):
+    """Devuelve la versión de esquema guardada en la base de datos."""
+    return conn.exec_driver_sql('PRAGMA user_version').scalar()
+
+
+def marcar_version_actual(conn):
+    """Marca una base de datos recién creada como actualizada."""
+    conn.exec_driver_sql(f'PRAGMA user_version = {VERSION_ACTUAL}')
+
+
+def migrar(bind=engine):
+    """Aplica, cada uno en su propia transacción, los pasos pendientes."""
+    aplicadas = []
+    for numero, paso in MIGRACIONES:
+        with bind.begin() as conn:
+            if version_esquema(conn) >= numero:
+                continue
+            paso(conn)
+            conn.exec_driver_sql(f'PRAGMA user_version = {numero}')
+        aplicadas.append(numero)
+    return aplicadas
+
+
+if __name__ == '__main__':
+    aplicadas = migrar()
+    if aplicadas:
+        print(f"Migraciones aplicadas: {', '.join(map(str, aplicadas))}.")
+    else:
+        print("La base de datos ya estaba actualizada.")
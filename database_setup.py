@@ -1,19 +1,19 @@
 # database_setup.py
 import datetime
-from models import Asistencia, Base, Profesor, Estudiante, Materia, Inscripcion, engine, session
-
-# Crear todas las tablas
+from models import Base, Profesor, Estudiante, Materia, Inscripcion, engine, session
+from database_migrate import crear_indice_busqueda, marcar_version_actual
+from servicios import ALTA, registrar_cambio_inscripciones
+
+# Recrear todas las tablas desde cero: create_all conserva las tablas que ya
+# existen con su esquema antiguo, y la versión solo puede marcarse como actual
+# si el esquema es el de models.py (para conservar datos, database_migrate.py)
+Base.metadata.drop_all(engine)
 Base.metadata.create_all(engine)
+with engine.begin() as conn:
+    crear_indice_busqueda(conn)
+    marcar_version_actual(conn)
 print("Tablas creadas en la base de datos.")
 
-# Limpiar datos existentes (opcional, útil para pruebas)
-session.query(Inscripcion).delete()
-session.query(Asistencia).delete()
-session.query(Materia).delete()
-session.query(Profesor).delete()
-session.query(Estudiante).delete()
-session.commit()
-
 # --- Insertar Datos de Prueba ---
 
 # Profesores
@@ -41,6 +41,8 @@ insc3 = Inscripcion(estudiante=est2, materia=mat2)
 insc4 = Inscripcion(estudiante=est3, materia=mat2)
 
 session.add_all([insc1, insc2, insc3, insc4])
+session.flush()
+registrar_cambio_inscripciones(session, ALTA)
 session.commit()
 
 print("Datos de prueba insertados correctamente.")
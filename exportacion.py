@@ -0,0 +1,92 @@
+# exportacion.py
+# Exportación de asistencias a CSV en streaming: las filas se leen de la base de
+# datos por lotes y se envían al cliente a medida que se generan, por lo que la
+# memoria usada no depende del tamaño del historial. Los periodos archivados
+# (ver archivo.py) se exportan primero: sus fechas son anteriores a las vivas.
+import csv
+import io
+from itertools import islice
+from sqlalchemy import String, select, type_coerce
+from archivo import consulta_archivada, fecha_limite_archivo, registros_archivados
+from models import Asistencia, Estudiante, Inscripcion, Materia
+
+# Filas que se leen de la base de datos (y se envían) en cada lote
+TAMANO_LOTE_EXPORTACION = 2000
+
+COLUMNAS = ['fecha', 'codigo_materia', 'materia', 'codigo_estudiante', 'apellido', 'nombre', 'estado']
+
+
+def consulta_exportacion(materia_id=None, estudiante_id=None, desde=None, hasta=None):
+    """Construye la consulta por columnas de las asistencias a exportar, ordenada por fecha."""
+    consulta = (
+        select(
+            # La fecha se lee como texto para no convertirla fila a fila
+            type_coerce(Asistencia.fecha, String),
+            Materia.codigo_materia,
+            Materia.nombre_materia,
+            Estudiante.codigo_estudiante,
+            Estudiante.apellido,
+            Estudiante.nombre,
+            Asistencia.presente,
+        )
+        .join(Inscripcion, Inscripcion.id == Asistencia.inscripcion_id)
+        .join(Materia, Materia.id == Inscripcion.materia_id)
+        .join(Estudiante, Estudiante.id == Inscripcion.estudiante_id)
+        .order_by(Asistencia.fecha, Asistencia.id)
+    )
+    if materia_id is not None:
+        consulta = consulta.where(Inscripcion.materia_id == materia_id)
+    if estudiante_id is not None:
+        consulta = consulta.where(Inscripcion.estudiante_id == estudiante_id)
+    if desde is not None:
+        consulta = consulta.where(Asistencia.fecha >= desde)
+    if hasta is not None:
+        consulta = consulta.where(Asistencia.fecha <= hasta)
+    return consulta
+
+
+def filas_archivadas(session, materia_id=None, estudiante_id=None, desde=None, hasta=None):
+    """Genera las filas de los periodos archivados con las mismas columnas que consulta_exportacion()."""
+    consulta = (
+        consulta_archivada(
+            Materia.codigo_materia, Materia.nombre_materia,
+            Estudiante.codigo_estudiante, Estudiante.apellido, Estudiante.nombre,
+        )
+        .join(Materia, Materia.id == Inscripcion.materia_id)
+        .join(Estudiante, Estudiante.id == Inscripcion.estudiante_id)
+    )
+    if materia_id is not None:
+        consulta = consulta.where(Inscripcion.materia_id == materia_id)
+    if estudiante_id is not None:
+        consulta = consulta.where(Inscripcion.estudiante_id == estudiante_id)
+    for fecha, _, presente, *columnas in registros_archivados(session, consulta, desde, hasta):
+        yield (fecha.isoformat(), *columnas, presente)
+
+
+def generar_csv(session, lote=TAMANO_LOTE_EXPORTACION, **filtros):
+    """Genera el CSV por fragmentos de texto, uno por cada lote de filas."""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+
+    def vaciar():
+        contenido = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return contenido
+
+    # BOM para que las hojas de cálculo detecten UTF-8 (acentos en los nombres)
+    buffer.write('\ufeff')
+    escritor.writerow(COLUMNAS)
+    yield vaciar()
+
+    limite_archivo = fecha_limite_archivo(session)
+    if limite_archivo is not None and (filtros.get('desde') is None or filtros['desde'] <= limite_archivo):
+        archivadas = filas_archivadas(session, **filtros)
+        while filas := list(islice(archivadas, lote)):
+            escritor.writerows(fila[:-1] + ('Presente' if fila[-1] else 'Ausente',) for fila in filas)
+            yield vaciar()
+
+    resultado = session.connection().execution_options(yield_per=lote).execute(consulta_exportacion(**filtros))
+    for filas in resultado.partitions():
+        escritor.writerows(fila[:-1] + ('Presente' if fila[-1] else 'Ausente',) for fila in filas)
+        yield vaciar()
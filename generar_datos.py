@@ -0,0 +1,138 @@
+# generar_datos.py
+# Genera una base de datos SQLite con datos sintéticos a escala real (profesores,
+# estudiantes, materias, inscripciones y semestres de asistencia) para medir el
+# rendimiento de la aplicación. Uso:
+#
+#   python generar_datos.py --db bench.db --estudiantes 5000 --materias 200
+#
+# No usar sobre la base de datos de producción: el archivo destino se recrea.
+import argparse
+import datetime
+import os
+import random
+import time
+
+# Días de la semana (0 = lunes) en que puede reunirse una materia
+COMBINACIONES_DIAS = [(0, 2), (1, 3), (2, 4), (0, 3), (1, 4)]
+SEMANAS_POR_SEMESTRE = 16
+# Filas por executemany
+TAMANO_LOTE = 20000
+
+
+def _argumentos():
+    parser = argparse.ArgumentParser(description='Genera datos sintéticos de asistencia.')
+    parser.add_argument('--db', required=True, help='Archivo SQLite a crear (se sobrescribe).')
+    parser.add_argument('--profesores', type=int, default=50)
+    parser.add_argument('--estudiantes', type=int, default=5000)
+    parser.add_argument('--materias', type=int, default=200)
+    parser.add_argument('--inscripciones-por-estudiante', type=int, default=5)
+    parser.add_argument('--semestres', type=int, default=2, help='Semestres de asistencia diaria hasta hoy.')
+    parser.add_argument('--semilla', type=int, default=42)
+    return parser.parse_args()
+
+
+def _fechas_de_clase(dias_semana, semestres, hoy):
+    """Fechas en que se reúne una materia durante los últimos semestres."""
+    inicio = hoy - datetime.timedelta(weeks=SEMANAS_POR_SEMESTRE * semestres)
+    inicio -= datetime.timedelta(days=inicio.weekday())
+    fechas = []
+    for semana in range(SEMANAS_POR_SEMESTRE * semestres):
+        for dia in dias_semana:
+            fecha = inicio + datetime.timedelta(weeks=semana, days=dia)
+            if fecha <= hoy:
+                fechas.append(fecha.isoformat())
+    return fechas
+
+
+def _insertar(conn, sql, filas):
+    """Inserta filas (iterable de tuplas) con executemany por lotes."""
+    lote = []
+    total = 0
+    for fila in filas:
+        lote.append(fila)
+        if len(lote) >= TAMANO_LOTE:
+            conn.exec_driver_sql(sql, lote)
+            total += len(lote)
+            lote = []
+    if lote:
+        conn.exec_driver_sql(sql, lote)
+        total += len(lote)
+    return total
+
+
+def generar(args):
+    # La URL debe fijarse antes de importar models (el engine se crea al importarlo)
+    os.environ['ASISTENCIA_DATABASE_URL'] = f'sqlite:///{os.path.abspath(args.db)}'
+    from models import Base, engine, session
+    from database_migrate import crear_indice_busqueda, marcar_version_actual
+    from servicios import reconstruir_resumen
+
+    for sufijo in ('', '-wal', '-shm'):
+        if os.path.exists(args.db + sufijo):
+            os.remove(args.db + sufijo)
+
+    azar = random.Random(args.semilla)
+    hoy = datetime.date.today()
+    inicio = time.perf_counter()
+
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        marcar_version_actual(conn)
+        conn.exec_driver_sql('PRAGMA synchronous=OFF')
+
+        _insertar(conn, 'INSERT INTO profesores (id, nombre, apellido, especialidad, is_active) VALUES (?, ?, ?, ?, 1)', (
+            (i, f'Profesor{i}', f'Apellido{i}', 'General') for i in range(1, args.profesores + 1)
+        ))
+        _insertar(conn, 'INSERT INTO estudiantes (id, nombre, apellido, codigo_estudiante, is_active) VALUES (?, ?, ?, ?, 1)', (
+            (i, f'Estudiante{i}', f'Apellido{i:06d}', f'E{i:07d}') for i in range(1, args.estudiantes + 1)
+        ))
+        _insertar(conn, 'INSERT INTO materias (id, nombre_materia, codigo_materia, profesor_id) VALUES (?, ?, ?, ?)', (
+            (i, f'Materia {i}', f'MAT-{i:04d}', azar.randint(1, args.profesores)) for i in range(1, args.materias + 1)
+        ))
+
+        # Inscripciones: cada estudiante en N materias distintas
+        por_estudiante = min(args.inscripciones_por_estudiante, args.materias)
+        inscripciones = []
+        for estudiante_id in range(1, args.estudiantes + 1):
+            for materia_id in azar.sample(range(1, args.materias + 1), por_estudiante):
+                inscripciones.append((len(inscripciones) + 1, estudiante_id, materia_id))
+        _insertar(conn, 'INSERT INTO inscripciones (id, estudiante_id, materia_id, fecha_inscripcion) VALUES (?, ?, ?, ?)', (
+            fila + (hoy.isoformat(),) for fila in inscripciones
+        ))
+        # Altas en el registro de cambios, para la sincronización de dispositivos
+        conn.exec_driver_sql(
+            "INSERT INTO cambios (entidad, entidad_id, materia_id, operacion, fecha_hora) "
+            "SELECT 'inscripcion', id, materia_id, 'alta', datetime('now', 'localtime') FROM inscripciones ORDER BY id"
+        )
+
+        # Asistencias: cada materia se reúne dos días por semana; cada
+        # estudiante tiene su propia probabilidad de asistir
+        fechas_materia = {
+            materia_id: _fechas_de_clase(azar.choice(COMBINACIONES_DIAS), args.semestres, hoy)
+            for materia_id in range(1, args.materias + 1)
+        }
+        tasa_estudiante = [azar.uniform(0.55, 0.98) for _ in range(args.estudiantes + 1)]
+
+        def asistencias():
+            for inscripcion_id, estudiante_id, materia_id in inscripciones:
+                tasa = tasa_estudiante[estudiante_id]
+                for fecha in fechas_materia[materia_id]:
+                    yield inscripcion_id, fecha, azar.random() < tasa
+
+        total_asistencias = _insertar(
+            conn, 'INSERT INTO asistencias (inscripcion_id, fecha, presente) VALUES (?, ?, ?)', asistencias()
+        )
+        # Después de insertar los estudiantes: una reconstrucción es más rápida que los triggers
+        crear_indice_busqueda(conn)
+
+    reconstruir_resumen(session)
+    session.commit()
+    session.remove()
+
+    print(f'{args.profesores} profesores, {args.estudiantes} estudiantes, {args.materias} materias, '
+          f'{len(inscripciones)} inscripciones y {total_asistencias} asistencias '
+          f'generadas en {time.perf_counter() - inicio:.1f} s.')
+
+
+if __name__ == '__main__':
+    generar(_argumentos())
@@ -0,0 +1,150 @@
+# importacion.py
+# Importación masiva de estudiantes, materias e inscripciones desde CSV. El
+# archivo se lee en streaming y se procesa por lotes: los duplicados se
+# comprueban con una consulta por lote y cada lote se inserta y confirma en
+# una sola transacción.
+import csv
+from collections import namedtuple
+from itertools import islice
+from sqlalchemy import insert, select
+from models import Estudiante, Inscripcion, Materia, Profesor
+from servicios import ALTA, incrementar_versiones, lotes, registrar_cambio_inscripciones
+
+# Filas del CSV que se insertan en cada transacción
+TAMANO_LOTE_IMPORTACION = 5000
+
+ErrorImportacion = namedtuple('ErrorImportacion', ['linea', 'mensaje'])
+
+
+class ResultadoImportacion:
+    """Filas insertadas y errores (por número de línea) de una importación."""
+
+    def __init__(self):
+        self.insertados = 0
+        self.errores = []
+
+    def error(self, linea, mensaje):
+        self.errores.append(ErrorImportacion(linea, mensaje))
+
+
+def _valores_existentes(session, columna, valores):
+    """Devuelve el subconjunto de 'valores' que ya existe en 'columna'."""
+    existentes = set()
+    for lote in lotes(list(valores)):
+        existentes.update(session.scalars(select(columna).where(columna.in_(lote))))
+    return existentes
+
+
+def _mapa_por_codigo(session, columna_codigo, codigos):
+    """Devuelve {codigo: id} para los códigos que existen."""
+    modelo = columna_codigo.class_
+    mapa = {}
+    for lote in lotes(list(codigos)):
+        mapa.update(session.execute(select(columna_codigo, modelo.id).where(columna_codigo.in_(lote))).all())
+    return mapa
+
+
+def _importar_estudiantes(session, filas, resultado, vistos):
+    existentes = _valores_existentes(session, Estudiante.codigo_estudiante, {f['codigo_estudiante'] for _, f in filas})
+    nuevos = []
+    for linea, fila in filas:
+        codigo = fila['codigo_estudiante']
+        if codigo in existentes or codigo in vistos:
+            resultado.error(linea, f'El código de estudiante {codigo} ya existe.')
+            continue
+        vistos.add(codigo)
+        nuevos.append({'nombre': fila['nombre'], 'apellido': fila['apellido'], 'codigo_estudiante': codigo})
+    if nuevos:
+        session.execute(insert(Estudiante), nuevos)
+    return len(nuevos)
+
+
+def _importar_materias(session, filas, resultado, vistos):
+    existentes = _valores_existentes(session, Materia.codigo_materia, {f['codigo_materia'] for _, f in filas})
+    ids_profesores = {f['profesor_id'] for _, f in filas if f['profesor_id'].isdigit()}
+    profesores = _valores_existentes(session, Profesor.id, {int(i) for i in ids_profesores})
+    nuevas = []
+    for linea, fila in filas:
+        codigo = fila['codigo_materia']
+        if codigo in existentes or codigo in vistos:
+            resultado.error(linea, f'El código de materia {codigo} ya existe.')
+            continue
+        if not fila['profesor_id'].isdigit() or int(fila['profesor_id']) not in profesores:
+            resultado.error(linea, f"No existe el profesor con ID {fila['profesor_id']}.")
+            continue
+        vistos.add(codigo)
+        nuevas.append({'nombre_materia': fila['nombre_materia'], 'codigo_materia': codigo,
+                       'profesor_id': int(fila['profesor_id'])})
+    if nuevas:
+        session.execute(insert(Materia), nuevas)
+        # Las páginas de los profesores listan sus materias
+        incrementar_versiones(session, *(f"profesor:{materia['profesor_id']}" for materia in nuevas))
+    return len(nuevas)
+
+
+def _importar_inscripciones(session, filas, resultado, vistos):
+    estudiantes = _mapa_por_codigo(session, Estudiante.codigo_estudiante, {f['codigo_estudiante'] for _, f in filas})
+    materias = _mapa_por_codigo(session, Materia.codigo_materia, {f['codigo_materia'] for _, f in filas})
+    existentes = set()
+    for lote in lotes(list(set(estudiantes.values()))):
+        existentes.update(session.execute(
+            select(Inscripcion.estudiante_id, Inscripcion.materia_id).where(Inscripcion.estudiante_id.in_(lote))
+        ).tuples())
+    nuevas = []
+    for linea, fila in filas:
+        estudiante_id = estudiantes.get(fila['codigo_estudiante'])
+        materia_id = materias.get(fila['codigo_materia'])
+        if estudiante_id is None:
+            resultado.error(linea, f"No existe el estudiante {fila['codigo_estudiante']}.")
+        elif materia_id is None:
+            resultado.error(linea, f"No existe la materia {fila['codigo_materia']}.")
+        elif (estudiante_id, materia_id) in existentes or (estudiante_id, materia_id) in vistos:
+            resultado.error(linea, 'Este estudiante ya está inscrito en esa materia.')
+        else:
+            vistos.add((estudiante_id, materia_id))
+            nuevas.append({'estudiante_id': estudiante_id, 'materia_id': materia_id})
+    if nuevas:
+        ids = session.scalars(insert(Inscripcion).returning(Inscripcion.id), nuevas).all()
+        for lote in lotes(ids):
+            registrar_cambio_inscripciones(session, ALTA, Inscripcion.id.in_(lote))
+    return len(nuevas)
+
+
+# tipo -> (columnas obligatorias del CSV, función de importación por lote)
+IMPORTADORES = {
+    'estudiantes': (('nombre', 'apellido', 'codigo_estudiante'), _importar_estudiantes),
+    'materias': (('nombre_materia', 'codigo_materia', 'profesor_id'), _importar_materias),
+    'inscripciones': (('codigo_estudiante', 'codigo_materia'), _importar_inscripciones),
+}
+
+
+def importar_csv(session, tipo, archivo, lote=TAMANO_LOTE_IMPORTACION):
+    """Importa un CSV (objeto de texto) del tipo indicado y devuelve un ResultadoImportacion."""
+    columnas, importar_lote = IMPORTADORES[tipo]
+    resultado = ResultadoImportacion()
+    lector = csv.DictReader(archivo)
+    faltantes = [c for c in columnas if c not in (lector.fieldnames or [])]
+    if faltantes:
+        resultado.error(1, f"Faltan columnas en el encabezado: {', '.join(faltantes)}.")
+        return resultado
+
+    def filas_validas():
+        for fila in lector:
+            valores = {c: (fila.get(c) or '').strip() for c in columnas}
+            vacias = [c for c in columnas if not valores[c]]
+            if vacias:
+                resultado.error(lector.line_num, f"Campos vacíos: {', '.join(vacias)}.")
+                continue
+            yield lector.line_num, valores
+
+    # Claves ya insertadas en este archivo, para detectar duplicados entre lotes
+    vistos = set()
+    filas = filas_validas()
+    while True:
+        bloque = list(islice(filas, lote))
+        if not bloque:
+            break
+        resultado.insertados += importar_lote(session, bloque, resultado, vistos)
+        session.commit()
+    resultado.errores.sort()
+    return resultado
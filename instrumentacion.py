@@ -0,0 +1,170 @@
+# instrumentacion.py
+# Perfilado opcional por petición: tiempo total, tiempo de renderizado de
+# plantillas, número de sentencias SQL y tiempo en la base de datos (medido con
+# los eventos del engine de SQLAlchemy). Las peticiones que superan el
+# presupuesto de consultas o de latencia se registran en el log (suele ser la
+# señal de un patrón N+1). Los histogramas agregados se consultan en /metricas,
+# con el token de app.config['PERFIL_TOKEN'].
+import bisect
+import hmac
+import threading
+import time
+from collections import deque
+from flask import g, has_request_context, jsonify, request, abort, before_render_template, template_rendered
+from sqlalchemy import event
+
+# Límites superiores de los intervalos de los histogramas
+LIMITES_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+LIMITES_CONSULTAS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+# Peticiones fuera de presupuesto que se conservan para /metricas
+MAX_MARCADAS = 50
+
+
+class Histograma:
+    """Cuenta observaciones por intervalos fijos, con suma y máximo."""
+
+    def __init__(self, limites):
+        self.limites = limites
+        self.cuentas = [0] * (len(limites) + 1)
+        self.suma = 0
+        self.maximo = 0
+
+    def observar(self, valor):
+        self.cuentas[bisect.bisect_left(self.limites, valor)] += 1
+        self.suma += valor
+        self.maximo = max(self.maximo, valor)
+
+    def como_dict(self):
+        etiquetas = [f'<={limite}' for limite in self.limites] + [f'>{self.limites[-1]}']
+        return {
+            # Lista de pares para conservar el orden de los intervalos en el JSON
+            'intervalos': [[etiqueta, cuenta] for etiqueta, cuenta in zip(etiquetas, self.cuentas)],
+            'suma': round(self.suma, 2),
+            'maximo': round(self.maximo, 2),
+        }
+
+
+class MetricasRuta:
+    def __init__(self):
+        self.peticiones = 0
+        self.fuera_de_presupuesto = 0
+        self.tiempo_ms = Histograma(LIMITES_MS)
+        self.plantillas_ms = Histograma(LIMITES_MS)
+        self.db_ms = Histograma(LIMITES_MS)
+        self.consultas = Histograma(LIMITES_CONSULTAS)
+
+
+class Metricas:
+    """Agregado de métricas por endpoint, seguro entre hilos."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.rutas = {}
+        self.marcadas = deque(maxlen=MAX_MARCADAS)
+
+    def registrar(self, endpoint, perfil, fuera_de_presupuesto):
+        with self._lock:
+            ruta = self.rutas.setdefault(endpoint, MetricasRuta())
+            ruta.peticiones += 1
+            ruta.tiempo_ms.observar(perfil['tiempo_ms'])
+            ruta.plantillas_ms.observar(perfil['plantillas_ms'])
+            ruta.db_ms.observar(perfil['db_ms'])
+            ruta.consultas.observar(perfil['consultas'])
+            if fuera_de_presupuesto:
+                ruta.fuera_de_presupuesto += 1
+                self.marcadas.append({'endpoint': endpoint, **perfil})
+
+    def como_dict(self):
+        with self._lock:
+            return {
+                'rutas': {
+                    endpoint: {
+                        'peticiones': ruta.peticiones,
+                        'fuera_de_presupuesto': ruta.fuera_de_presupuesto,
+                        'tiempo_ms': ruta.tiempo_ms.como_dict(),
+                        'plantillas_ms': ruta.plantillas_ms.como_dict(),
+                        'db_ms': ruta.db_ms.como_dict(),
+                        'consultas': ruta.consultas.como_dict(),
+                    }
+                    for endpoint, ruta in self.rutas.items()
+                },
+                'fuera_de_presupuesto': list(self.marcadas),
+            }
+
+
+def init_instrumentacion(app, engine):
+    """Activa el perfilado si app.config['PERFILADO'] es verdadero."""
+    if not app.config.get('PERFILADO'):
+        return None
+    metricas = Metricas()
+    app.extensions['metricas'] = metricas
+    max_consultas = app.config.get('PERFIL_MAX_CONSULTAS', 20)
+    max_ms = app.config.get('PERFIL_MAX_MS', 500)
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _antes_sql(conn, cursor, statement, parameters, context, executemany):
+        conn.info['perfil_inicio_sql'] = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _despues_sql(conn, cursor, statement, parameters, context, executemany):
+        inicio = conn.info.pop('perfil_inicio_sql', None)
+        if inicio is not None and has_request_context() and 'perfil' in g:
+            g.perfil['consultas'] += 1
+            g.perfil['db_ms'] += (time.perf_counter() - inicio) * 1000
+
+    def _antes_plantilla(sender, template, context, **extra):
+        if 'perfil' in g:
+            g.perfil_inicio_plantilla = time.perf_counter()
+
+    def _despues_plantilla(sender, template, context, **extra):
+        inicio = g.pop('perfil_inicio_plantilla', None)
+        if inicio is not None:
+            g.perfil['plantillas_ms'] += (time.perf_counter() - inicio) * 1000
+
+    # weak=False: las funciones son locales y se perderían al salir de esta función
+    before_render_template.connect(_antes_plantilla, app, weak=False)
+    template_rendered.connect(_despues_plantilla, app, weak=False)
+
+    @app.before_request
+    def _iniciar_perfil():
+        g.perfil = {'consultas': 0, 'db_ms': 0.0, 'plantillas_ms': 0.0}
+        g.perfil_inicio = time.perf_counter()
+
+    @app.after_request
+    def _registrar_perfil(response):
+        if 'perfil' not in g or request.endpoint in (None, 'static', 'metricas'):
+            return response
+        perfil = g.perfil
+        perfil['tiempo_ms'] = (time.perf_counter() - g.perfil_inicio) * 1000
+        fuera = perfil['consultas'] > max_consultas or perfil['tiempo_ms'] > max_ms
+        if fuera:
+            app.logger.warning(
+                'Petición fuera de presupuesto: %s %s (%d consultas, %.1f ms)',
+                request.method, request.path, perfil['consultas'], perfil['tiempo_ms'],
+            )
+        metricas.registrar(request.endpoint, {'ruta': request.path, **{
+            clave: round(valor, 2) for clave, valor in perfil.items()
+        }}, fuera)
+        if app.config.get('PERFIL_CABECERA'):
+            response.headers['Server-Timing'] = (
+                f"db;dur={perfil['db_ms']:.1f};desc=\"{perfil['consultas']} consultas\", "
+                f"tpl;dur={perfil['plantillas_ms']:.1f}, total;dur={perfil['tiempo_ms']:.1f}"
+            )
+        return response
+
+    token = app.config.get('PERFIL_TOKEN')
+
+    def ver_metricas():
+        """Histogramas agregados por ruta (con 'Authorization: Bearer <token>' o ?token=).
+
+        Sin token configurado no se sirven: detrás de un proxy todas las
+        peticiones llegan desde 127.0.0.1, así que la dirección no sirve de control.
+        """
+        cabecera = request.headers.get('Authorization', '')
+        recibido = cabecera[len('Bearer '):] if cabecera.startswith('Bearer ') else request.args.get('token', '')
+        if not token or not hmac.compare_digest(recibido.encode(), token.encode()):
+            abort(404)
+        return jsonify(metricas.como_dict())
+
+    app.add_url_rule('/metricas', 'metricas', ver_metricas)
+    return metricas
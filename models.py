@@ -1,7 +1,8 @@
 # models.py
 import datetime
-from sqlalchemy import create_engine, Column, Integer, String, Date, Boolean, ForeignKey
-from sqlalchemy.orm import relationship, sessionmaker, declarative_base
+import os
+from sqlalchemy import create_engine, event, Column, Integer, String, Date, DateTime, Boolean, Float, ForeignKey, Index, LargeBinary
+from sqlalchemy.orm import relationship, sessionmaker, scoped_session, declarative_base
 
 Base = declarative_base()
 
@@ -30,7 +31,8 @@ class Materia(Base):
     codigo_materia = Column(String(20), unique=True, nullable=False)
     profesor_id = Column(Integer, ForeignKey('profesores.id'))
     profesor = relationship("Profesor", back_populates="materias")
-    inscripciones = relationship("Inscripcion", back_populates="materia", cascade="all, delete-orphan")
+    # Sin cascada en el ORM: las materias se eliminan con borrados por conjuntos (ver purgas.py)
+    inscripciones = relationship("Inscripcion", back_populates="materia", passive_deletes='all')
 
 class Inscripcion(Base):
     __tablename__ = 'inscripciones'
@@ -38,10 +40,24 @@ class Inscripcion(Base):
     estudiante_id = Column(Integer, ForeignKey('estudiantes.id'))
     materia_id = Column(Integer, ForeignKey('materias.id'))
     fecha_inscripcion = Column(Date, default=datetime.date.today)
+    # Purga pendiente de una materia eliminada: la inscripción queda sin
+    # estudiante ni materia (conserva su id) hasta que se borran sus asistencias
+    purga_id = Column(Integer, ForeignKey('purgas.id'))
+
+    __table_args__ = (
+        # Un estudiante solo puede inscribirse una vez por materia; el índice
+        # también sirve las búsquedas por estudiante_id
+        Index('ux_inscripciones_estudiante_materia', 'estudiante_id', 'materia_id', unique=True),
+        Index('ix_inscripciones_materia_id', 'materia_id'),
+        Index('ix_inscripciones_purga_id', 'purga_id'),
+    )
     
     estudiante = relationship("Estudiante")
     materia = relationship("Materia")
-    asistencias = relationship("Asistencia", back_populates="inscripcion", cascade="all, delete-orphan")
+    # Sin cascada en el ORM: las inscripciones se eliminan con borrados por conjuntos (ver purgas.py)
+    asistencias = relationship("Asistencia", back_populates="inscripcion", passive_deletes='all')
+    resumen = relationship("ResumenAsistencia", uselist=False, passive_deletes='all')
+    asistencias_archivadas = relationship("AsistenciaArchivada", back_populates="inscripcion", passive_deletes='all')
 
 class Asistencia(Base):
     __tablename__ = 'asistencias'
@@ -49,11 +65,157 @@ class Asistencia(Base):
     inscripcion_id = Column(Integer, ForeignKey('inscripciones.id'))
     fecha = Column(Date, nullable=False)
     presente = Column(Boolean, default=False, nullable=False)
+    # Id del Cambio con el que se escribió por última vez (0 = antes del registro de cambios)
+    version = Column(Integer, default=0, server_default='0', nullable=False)
+
+    __table_args__ = (
+        # Un único registro por inscripción y fecha; el índice también sirve
+        # las búsquedas por inscripcion_id
+        Index('ux_asistencias_inscripcion_fecha', 'inscripcion_id', 'fecha', unique=True),
+        Index('ix_asistencias_fecha', 'fecha'),
+        Index('ix_asistencias_version', 'version'),
+    )
 
     inscripcion = relationship("Inscripcion", back_populates="asistencias")
 
+class ResumenAsistencia(Base):
+    # Contadores por inscripción que se actualizan en la misma transacción que
+    # cada escritura de asistencias (ver servicios.py). Se pueden reconstruir
+    # desde cero con `flask --app app reconstruir-resumen`.
+    __tablename__ = 'resumen_asistencias'
+    inscripcion_id = Column(Integer, ForeignKey('inscripciones.id'), primary_key=True)
+    total_clases = Column(Integer, default=0, nullable=False)
+    clases_presente = Column(Integer, default=0, nullable=False)
+    ultima_fecha = Column(Date)
+
+class AsistenciaArchivada(Base):
+    # Asistencia de una inscripción en un periodo cerrado, comprimida en dos
+    # mapas de bits indexados por día desde fecha_inicio (bit i = fecha_inicio + i
+    # días): 'sesiones' marca los días con registro y 'presentes' los días con
+    # asistencia. Ver archivo.py.
+    __tablename__ = 'asistencias_archivadas'
+    inscripcion_id = Column(Integer, ForeignKey('inscripciones.id'), primary_key=True)
+    fecha_inicio = Column(Date, primary_key=True)
+    fecha_fin = Column(Date, nullable=False)
+    total_clases = Column(Integer, nullable=False)
+    clases_presente = Column(Integer, nullable=False)
+    sesiones = Column(LargeBinary, nullable=False)
+    presentes = Column(LargeBinary, nullable=False)
+
+    inscripcion = relationship("Inscripcion", back_populates="asistencias_archivadas")
+
+class PeriodoArchivado(Base):
+    # Cada ejecución de `flask archivar`: las fechas hasta 'hasta' (incluida) ya
+    # no están en la tabla asistencias y no admiten escrituras.
+    __tablename__ = 'periodos_archivados'
+    id = Column(Integer, primary_key=True)
+    desde = Column(Date, nullable=False)
+    hasta = Column(Date, nullable=False, unique=True)
+    registros = Column(Integer, nullable=False)
+    fecha_hora = Column(DateTime, default=datetime.datetime.now)
+
+class Cambio(Base):
+    # Registro de cambios para la sincronización incremental de dispositivos.
+    # Cada alta, baja o modificación de una inscripción deja una fila; cada
+    # escritura de asistencias deja una fila 'asistencias' cuyo id se guarda en
+    # asistencias.version. Los ids son crecientes (AUTOINCREMENT, sin reutilizar).
+    __tablename__ = 'cambios'
+    id = Column(Integer, primary_key=True)
+    entidad = Column(String(20), nullable=False)
+    entidad_id = Column(Integer)
+    materia_id = Column(Integer)
+    operacion = Column(String(20), nullable=False)
+    fecha_hora = Column(DateTime, default=datetime.datetime.now)
+
+    __table_args__ = (
+        Index('ix_cambios_entidad_id', 'entidad', 'id'),
+        {'sqlite_autoincrement': True},
+    )
+
+class UmbralAsistencia(Base):
+    # Tasa de asistencia mínima (%) de una materia para el reporte de riesgo;
+    # las materias sin fila usan el umbral por defecto (ver reportes.py).
+    __tablename__ = 'umbrales_asistencia'
+    materia_id = Column(Integer, ForeignKey('materias.id'), primary_key=True)
+    umbral = Column(Float, nullable=False)
+
+class ReporteRiesgo(Base):
+    # Inscripciones por debajo del umbral, precalculadas por `flask reporte-riesgo`.
+    __tablename__ = 'reporte_riesgo'
+    inscripcion_id = Column(Integer, ForeignKey('inscripciones.id'), primary_key=True)
+    materia_id = Column(Integer, nullable=False)
+    estudiante_id = Column(Integer, nullable=False)
+    total_clases = Column(Integer, nullable=False)
+    clases_presente = Column(Integer, nullable=False)
+    tasa = Column(Float, nullable=False)
+    umbral = Column(Float, nullable=False)
+    actualizado = Column(DateTime, default=datetime.datetime.now)
+
+    __table_args__ = (
+        Index('ix_reporte_riesgo_tasa', 'tasa'),
+        Index('ix_reporte_riesgo_materia_tasa', 'materia_id', 'tasa'),
+    )
+
+class EstadoTrabajo(Base):
+    # Progreso de los trabajos en segundo plano: último id de cambios procesado.
+    __tablename__ = 'estado_trabajos'
+    nombre = Column(String(50), primary_key=True)
+    cursor = Column(Integer, default=0, nullable=False)
+    ejecutado = Column(DateTime)
+
+class Purga(Base):
+    # Borrado por lotes, en segundo plano, de las asistencias de una materia
+    # eliminada (ver purgas.py). 'total' y 'borrados' dan el progreso.
+    __tablename__ = 'purgas'
+    id = Column(Integer, primary_key=True)
+    descripcion = Column(String(200), nullable=False)
+    total = Column(Integer, nullable=False)
+    borrados = Column(Integer, default=0, nullable=False)
+    creada = Column(DateTime, default=datetime.datetime.now)
+    terminada = Column(DateTime)
+
+class VersionDatos(Base):
+    # Sello de versión de los datos que muestra una página ('materia:<id>',
+    # 'profesor:<id>', 'archivo'); se incrementa en cada escritura que los
+    # cambia. Da el ETag y la clave de la caché de páginas (ver app.py).
+    __tablename__ = 'versiones'
+    clave = Column(String(50), primary_key=True)
+    version = Column(Integer, default=0, nullable=False)
+    modificado = Column(DateTime, default=datetime.datetime.now, nullable=False)
+
 # Configuración de la base de datos
-engine = create_engine('sqlite:///asistencia.db')
-Base.metadata.bind = engine
+# Todos los valores se pueden ajustar con variables de entorno para desplegar
+# la aplicación con varios workers (p. ej. gunicorn) sin tocar el código.
+DATABASE_URL = os.environ.get('ASISTENCIA_DATABASE_URL', 'sqlite:///asistencia.db')
+POOL_SIZE = int(os.environ.get('ASISTENCIA_POOL_SIZE', 5))
+POOL_MAX_OVERFLOW = int(os.environ.get('ASISTENCIA_POOL_MAX_OVERFLOW', 10))
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('ASISTENCIA_SQLITE_BUSY_TIMEOUT_MS', 5000))
+SQLITE_SYNCHRONOUS = os.environ.get('ASISTENCIA_SQLITE_SYNCHRONOUS', 'NORMAL')
+
+engine_options = {'pool_pre_ping': True}
+if DATABASE_URL.startswith('sqlite') and ':memory:' not in DATABASE_URL:
+    # Cada hilo/worker obtiene su propia conexión del pool
+    engine_options.update(
+        pool_size=POOL_SIZE,
+        max_overflow=POOL_MAX_OVERFLOW,
+        connect_args={'check_same_thread': False, 'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000},
+    )
+
+engine = create_engine(DATABASE_URL, **engine_options)
+
+
+@event.listens_for(engine, 'connect')
+def configurar_sqlite(dbapi_connection, connection_record):
+    """Ajusta cada conexión SQLite para lectores concurrentes (WAL)."""
+    if not DATABASE_URL.startswith('sqlite'):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+    cursor.execute(f'PRAGMA synchronous={SQLITE_SYNCHRONOUS}')
+    cursor.close()
+
+
 DBSession = sessionmaker(bind=engine)
-session = DBSession()
\ No newline at end of file
+# Sesión por hilo/petición: app.py la cierra en cada teardown
+session = scoped_session(DBSession)
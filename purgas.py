@@ -0,0 +1,148 @@
+# purgas.py
+# Eliminación de materias e inscripciones con borrados por conjuntos (un
+# DELETE por tabla) en lugar de la cascada del ORM, que cargaba cada
+# inscripción y cada asistencia en memoria y las borraba una a una.
+#
+# Las materias con muchas asistencias no se borran en la petición: sus
+# inscripciones se desvinculan al momento (sin estudiante ni materia, con
+# purga_id) y un trabajo en segundo plano borra sus asistencias por lotes,
+# con un commit por lote, para no retener el bloqueo de escritura mientras los
+# profesores toman asistencia. El progreso se guarda en la tabla purgas.
+import datetime
+import os
+import threading
+import time
+from sqlalchemy import delete, func, select, update
+from models import (
+    Asistencia, AsistenciaArchivada, Inscripcion, Materia, Purga, ReporteRiesgo, ResumenAsistencia,
+    UmbralAsistencia,
+)
+from servicios import BAJA, registrar_cambio_inscripciones
+
+# Asistencias a partir de las cuales una materia se purga en segundo plano
+UMBRAL_PURGA_DIFERIDA = int(os.environ.get('ASISTENCIA_PURGA_DIFERIDA', 50000))
+# Asistencias borradas por transacción en una purga
+TAMANO_LOTE_PURGA = 2000
+# Segundos entre lotes, para que las escrituras de asistencia tomen el bloqueo
+PAUSA_PURGA = 0.05
+
+_hilo = None
+_lock_hilo = threading.Lock()
+
+
+def _borrar(session, sentencia):
+    return session.execute(sentencia.execution_options(synchronize_session=False)).rowcount
+
+
+def borrar_inscripciones(session, *condiciones):
+    """Borra las inscripciones que cumplen las condiciones y todos sus datos. No hace commit.
+
+    Las bajas deben anotarse antes en el registro de cambios.
+    """
+    ids = select(Inscripcion.id).where(*condiciones).scalar_subquery()
+    for modelo in (Asistencia, AsistenciaArchivada, ResumenAsistencia, ReporteRiesgo):
+        _borrar(session, delete(modelo).where(modelo.inscripcion_id.in_(ids)))
+    return _borrar(session, delete(Inscripcion).where(*condiciones))
+
+
+def borrar_materia(session, materia_id):
+    """Elimina una materia con sus inscripciones y asistencias. No hace commit.
+
+    Si tiene UMBRAL_PURGA_DIFERIDA asistencias o más, devuelve la Purga que
+    el trabajo en segundo plano completará; si no, lo borra todo y devuelve None.
+    """
+    registrar_cambio_inscripciones(session, BAJA, Inscripcion.materia_id == materia_id)
+    asistencias = session.scalar(
+        select(func.count()).select_from(Asistencia)
+        .join(Inscripcion, Inscripcion.id == Asistencia.inscripcion_id)
+        .where(Inscripcion.materia_id == materia_id)
+    )
+    purga = None
+    if asistencias < UMBRAL_PURGA_DIFERIDA:
+        borrar_inscripciones(session, Inscripcion.materia_id == materia_id)
+    else:
+        materia = session.get(Materia, materia_id)
+        purga = Purga(descripcion=f'Materia {materia.codigo_materia} - {materia.nombre_materia}', total=asistencias)
+        session.add(purga)
+        session.flush()
+        # Las inscripciones conservan su id (SQLite podría reutilizarlo) pero dejan
+        # de aparecer en cualquier consulta por estudiante o por materia
+        session.execute(
+            update(Inscripcion).where(Inscripcion.materia_id == materia_id)
+            .values(estudiante_id=None, materia_id=None, purga_id=purga.id)
+            .execution_options(synchronize_session=False)
+        )
+        # Lo que ocupa pocas filas por inscripción se borra ya; las asistencias, por lotes
+        ids = select(Inscripcion.id).where(Inscripcion.purga_id == purga.id).scalar_subquery()
+        for modelo in (AsistenciaArchivada, ResumenAsistencia, ReporteRiesgo):
+            _borrar(session, delete(modelo).where(modelo.inscripcion_id.in_(ids)))
+    _borrar(session, delete(UmbralAsistencia).where(UmbralAsistencia.materia_id == materia_id))
+    _borrar(session, delete(Materia).where(Materia.id == materia_id))
+    return purga
+
+
+def purgar_lote(session, maximo=TAMANO_LOTE_PURGA):
+    """Borra un lote de asistencias de la purga pendiente más antigua. No hace commit.
+
+    Al vaciarla borra también sus inscripciones y la da por terminada.
+    Devuelve la Purga procesada (None si no quedan pendientes).
+    """
+    purga = session.scalars(
+        select(Purga).where(Purga.terminada.is_(None)).order_by(Purga.id).limit(1)
+    ).first()
+    if purga is None:
+        return None
+    inscripciones = select(Inscripcion.id).where(Inscripcion.purga_id == purga.id).scalar_subquery()
+    lote = select(Asistencia.id).where(Asistencia.inscripcion_id.in_(inscripciones)).limit(maximo).scalar_subquery()
+    borrados = _borrar(session, delete(Asistencia).where(Asistencia.id.in_(lote)))
+    purga.borrados += borrados
+    if borrados < maximo:
+        borrar_inscripciones(session, Inscripcion.purga_id == purga.id)
+        purga.terminada = datetime.datetime.now()
+    return purga
+
+
+def ejecutar_purgas(session, pausa=PAUSA_PURGA):
+    """Procesa lotes, con un commit por lote, hasta que no queden purgas pendientes."""
+    while True:
+        try:
+            purga = purgar_lote(session)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.remove()
+        if purga is None:
+            return
+        time.sleep(pausa)
+
+
+def iniciar_purgas(app, session):
+    """Arranca el trabajo de purga como hilo daemon, si no hay ya uno en este proceso."""
+    global _hilo
+
+    def bucle():
+        try:
+            ejecutar_purgas(session)
+        except Exception:
+            app.logger.exception('Error purgando datos eliminados; se reanudará con `flask purgar`.')
+
+    with _lock_hilo:
+        if _hilo is None or not _hilo.is_alive():
+            _hilo = threading.Thread(target=bucle, name='purgas', daemon=True)
+            _hilo.start()
+    return _hilo
+
+
+def progreso_purga(purga):
+    """Estado de una purga como diccionario, para el endpoint de progreso."""
+    return {
+        'id': purga.id,
+        'descripcion': purga.descripcion,
+        'total': purga.total,
+        'borrados': purga.borrados,
+        'progreso': round(100 * purga.borrados / purga.total, 1) if purga.total else 100.0,
+        'terminada': purga.terminada.isoformat() if purga.terminada else None,
+        'creada': purga.creada.isoformat() if purga.creada else None,
+    }
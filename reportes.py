@@ -0,0 +1,170 @@
+# reportes.py
+# Reporte de estudiantes en riesgo: inscripciones cuya tasa de asistencia está
+# por debajo del umbral de su materia. Se precalcula en la tabla
+# reporte_riesgo y se actualiza de forma incremental: cada ejecución recalcula
+# solo las inscripciones tocadas desde la anterior, según el registro de
+# cambios (asistencias.version e ids de la tabla cambios). La ruta del reporte
+# solo lee la tabla precalculada.
+import datetime
+import os
+import threading
+import time
+from collections import namedtuple
+from sqlalchemy import delete, func, insert, literal, select, true
+from models import (
+    Asistencia, Cambio, EstadoTrabajo, Estudiante, Inscripcion, Materia, ReporteRiesgo, ResumenAsistencia,
+    UmbralAsistencia,
+)
+from servicios import ENTIDAD_INSCRIPCION, MODIFICACION, lotes
+
+# Tasa mínima (%) de las materias sin umbral propio
+UMBRAL_POR_DEFECTO = float(os.environ.get('ASISTENCIA_UMBRAL_RIESGO', 75))
+# Clases mínimas registradas antes de incluir una inscripción en el reporte
+MIN_CLASES_RIESGO = int(os.environ.get('ASISTENCIA_RIESGO_MIN_CLASES', 3))
+# Segundos entre ejecuciones del trabajo en segundo plano (0 = solo con `flask reporte-riesgo`)
+INTERVALO_REPORTE = float(os.environ.get('ASISTENCIA_REPORTE_INTERVALO', 0))
+# Filas por página del reporte
+TAMANO_PAGINA_REPORTE = 100
+
+TRABAJO_REPORTE = 'reporte_riesgo'
+# Entidad del registro de cambios para los umbrales (entidad_id = materia_id)
+ENTIDAD_UMBRAL = 'umbral'
+
+_hilo = None
+_lock_hilo = threading.Lock()
+
+ResultadoReporte = namedtuple('ResultadoReporte', ['inscripciones', 'materias', 'completo', 'cursor'])
+
+
+def _recalcular(session, inscripciones_ids=None, materias_ids=None):
+    """Vuelve a calcular las filas del reporte de esas inscripciones o materias (sin filtros, todas)."""
+    if inscripciones_ids is not None:
+        filtro_reporte = ReporteRiesgo.inscripcion_id.in_(inscripciones_ids)
+        filtro = Inscripcion.id.in_(inscripciones_ids)
+    elif materias_ids is not None:
+        filtro_reporte = ReporteRiesgo.materia_id.in_(materias_ids)
+        filtro = Inscripcion.materia_id.in_(materias_ids)
+    else:
+        filtro_reporte = filtro = true()
+
+    # Se borra por las columnas del reporte para quitar también las inscripciones ya eliminadas
+    session.execute(delete(ReporteRiesgo).where(filtro_reporte).execution_options(synchronize_session=False))
+    tasa = 100.0 * ResumenAsistencia.clases_presente / ResumenAsistencia.total_clases
+    umbral = func.coalesce(UmbralAsistencia.umbral, literal(UMBRAL_POR_DEFECTO))
+    session.execute(insert(ReporteRiesgo).from_select(
+        ['inscripcion_id', 'materia_id', 'estudiante_id', 'total_clases', 'clases_presente', 'tasa', 'umbral',
+         'actualizado'],
+        select(Inscripcion.id, Inscripcion.materia_id, Inscripcion.estudiante_id, ResumenAsistencia.total_clases,
+               ResumenAsistencia.clases_presente, tasa, umbral, literal(datetime.datetime.now()))
+        .join(ResumenAsistencia, ResumenAsistencia.inscripcion_id == Inscripcion.id)
+        .join(Estudiante, Estudiante.id == Inscripcion.estudiante_id)
+        .outerjoin(UmbralAsistencia, UmbralAsistencia.materia_id == Inscripcion.materia_id)
+        .where(filtro, Estudiante.is_active == True, ResumenAsistencia.total_clases >= MIN_CLASES_RIESGO,
+               tasa < umbral),
+    ))
+
+
+def actualizar_reporte(session, completo=False):
+    """Actualiza reporte_riesgo con los cambios posteriores a la ejecución anterior.
+
+    La primera ejecución (o con completo=True) lo recalcula entero. No hace
+    commit. Devuelve un ResultadoReporte.
+    """
+    estado = session.get(EstadoTrabajo, TRABAJO_REPORTE)
+    if estado is None:
+        estado = EstadoTrabajo(nombre=TRABAJO_REPORTE, cursor=0)
+        session.add(estado)
+        completo = True
+    # Los cambios se procesan hasta el último id confirmado en este momento
+    hasta = session.scalar(select(func.max(Cambio.id))) or 0
+
+    if completo:
+        _recalcular(session)
+        inscripciones = materias = ()
+    else:
+        inscripciones = set(session.scalars(
+            select(Asistencia.inscripcion_id).distinct()
+            .where(Asistencia.version > estado.cursor, Asistencia.version <= hasta)
+        ))
+        materias = set()
+        for entidad, entidad_id, materia_id in session.execute(
+            select(Cambio.entidad, Cambio.entidad_id, Cambio.materia_id)
+            .where(Cambio.id > estado.cursor, Cambio.id <= hasta,
+                   Cambio.entidad.in_([ENTIDAD_INSCRIPCION, ENTIDAD_UMBRAL]))
+        ):
+            if entidad == ENTIDAD_UMBRAL:
+                materias.add(materia_id)
+            else:
+                inscripciones.add(entidad_id)
+        for lote in lotes(sorted(materias)):
+            _recalcular(session, materias_ids=lote)
+        for lote in lotes(sorted(inscripciones)):
+            _recalcular(session, inscripciones_ids=lote)
+
+    estado.cursor = hasta
+    estado.ejecutado = datetime.datetime.now()
+    return ResultadoReporte(len(inscripciones), len(materias), completo, hasta)
+
+
+def guardar_umbrales(session, umbrales):
+    """Guarda {materia_id: umbral o None}; None vuelve al umbral por defecto. No hace commit."""
+    for materia_id, umbral in umbrales.items():
+        actual = session.get(UmbralAsistencia, materia_id)
+        if umbral is None:
+            if actual is None:
+                continue
+            session.delete(actual)
+        elif actual is None:
+            session.add(UmbralAsistencia(materia_id=materia_id, umbral=umbral))
+        elif actual.umbral != umbral:
+            actual.umbral = umbral
+        else:
+            continue
+        # El trabajo del reporte recalculará la materia en su próxima ejecución
+        session.add(Cambio(entidad=ENTIDAD_UMBRAL, entidad_id=materia_id, materia_id=materia_id,
+                           operacion=MODIFICACION))
+
+
+def consultar_reporte(session, materia_id=None, pagina=1, limite=TAMANO_PAGINA_REPORTE):
+    """Página del reporte, de la tasa más baja a la más alta; devuelve (filas, hay_mas)."""
+    consulta = (
+        select(ReporteRiesgo.inscripcion_id, ReporteRiesgo.materia_id, ReporteRiesgo.estudiante_id,
+               ReporteRiesgo.total_clases, ReporteRiesgo.clases_presente, ReporteRiesgo.tasa,
+               ReporteRiesgo.umbral, Materia.nombre_materia, Materia.codigo_materia,
+               Estudiante.nombre, Estudiante.apellido, Estudiante.codigo_estudiante)
+        .join(Materia, Materia.id == ReporteRiesgo.materia_id)
+        .join(Estudiante, Estudiante.id == ReporteRiesgo.estudiante_id)
+    )
+    if materia_id is not None:
+        consulta = consulta.where(ReporteRiesgo.materia_id == materia_id)
+    filas = session.execute(
+        consulta.order_by(ReporteRiesgo.tasa, ReporteRiesgo.inscripcion_id)
+        .limit(limite + 1).offset((pagina - 1) * limite)
+    ).all()
+    return [dict(fila._mapping) for fila in filas[:limite]], len(filas) > limite
+
+
+def iniciar_trabajo_reporte(app, session, intervalo=INTERVALO_REPORTE):
+    """Arranca el trabajo como hilo daemon que se ejecuta cada 'intervalo' segundos.
+
+    No arranca otro si ya hay uno en este proceso.
+    """
+    global _hilo
+
+    def bucle():
+        while True:
+            try:
+                actualizar_reporte(session)
+                session.commit()
+            except Exception:
+                session.rollback()
+                app.logger.exception('Error actualizando el reporte de riesgo; se reintentará.')
+            finally:
+                session.remove()
+            time.sleep(intervalo)
+
+    with _lock_hilo:
+        if _hilo is None or not _hilo.is_alive():
+            _hilo = threading.Thread(target=bucle, name='reporte-riesgo', daemon=True)
+            _hilo.start()
+    return _hilo
@@ -0,0 +1,646 @@
+# servicios.py
+# Operaciones de asistencia basadas en consultas por conjuntos. No hacen commit:
+# la ruta que las llama decide cuándo cerrar la transacción.
+import datetime
+import re
+from collections import namedtuple
+from itertools import dropwhile, islice
+from sqlalchemy import (
+    String, and_, case, column, delete, func, insert, literal, not_, or_, select, table, text, type_coerce, update,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import contains_eager
+from archivo import RegistroArchivado, comprobar_fechas, consulta_archivada, fecha_limite_archivo, registros_archivados
+from models import (
+    Asistencia, AsistenciaArchivada, Cambio, Estudiante, Inscripcion, Materia, Profesor, ResumenAsistencia, VersionDatos,
+)
+
+# Máximo de filas por sentencia (SQLite limita el número de parámetros)
+TAMANO_LOTE = 500
+# Registros por página en el historial de asistencias
+TAMANO_PAGINA_HISTORIAL = 50
+# Fechas que muestra la matriz de asistencia si no se indica un rango
+FECHAS_MATRIZ = 100
+# Estudiantes por página en el listado y la búsqueda
+TAMANO_PAGINA_ESTUDIANTES = 50
+# Cambios por respuesta en las rutas de sincronización
+TAMANO_PAGINA_CAMBIOS = 1000
+
+# Entidades y operaciones del registro de cambios (tabla cambios)
+ENTIDAD_INSCRIPCION, ENTIDAD_ASISTENCIAS = 'inscripcion', 'asistencias'
+ALTA, BAJA, MODIFICACION = 'alta', 'baja', 'modificacion'
+
+# Códigos de celda de la matriz de asistencia (un byte por celda)
+SIN_REGISTRO, AUSENTE, PRESENTE = 0, 1, 2
+
+ResultadoRegistro = namedtuple('ResultadoRegistro', ['insertados', 'actualizados', 'sin_cambios'])
+EstadisticaAsistencia = namedtuple('EstadisticaAsistencia', ['total', 'presentes', 'tasa'])
+DiferenciaResumen = namedtuple('DiferenciaResumen', ['inscripcion_id', 'guardado', 'real'])
+
+
+def lotes(elementos, tamano=TAMANO_LOTE):
+    """Divide una lista en trozos de como máximo 'tamano' elementos."""
+    for inicio in range(0, len(elementos), tamano):
+        yield elementos[inicio:inicio + tamano]
+
+
+def _insert(session, modelo):
+    """Devuelve un INSERT con soporte de ON CONFLICT para el motor en uso."""
+    dialecto = postgresql if session.get_bind().dialect.name == 'postgresql' else sqlite
+    return dialecto.insert(modelo)
+
+
+def nueva_version(session):
+    """Anota una escritura de asistencias en el registro de cambios y devuelve su id.
+
+    En SQLite la transacción mantiene el bloqueo de escritura hasta el commit,
+    así que las versiones quedan en el mismo orden en que se confirman.
+    """
+    return session.execute(
+        insert(Cambio).values(entidad=ENTIDAD_ASISTENCIAS, operacion=MODIFICACION,
+                              fecha_hora=datetime.datetime.now())
+    ).inserted_primary_key[0]
+
+
+def incrementar_versiones(session, *claves):
+    """Incrementa la versión de datos de cada clave ('materia:<id>', 'profesor:<id>', 'archivo')."""
+    if not claves:
+        return
+    ahora = datetime.datetime.now()
+    stmt = _insert(session, VersionDatos)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['clave'],
+        set_={'version': VersionDatos.version + 1, 'modificado': stmt.excluded.modificado},
+    )
+    session.execute(stmt, [{'clave': clave, 'version': 1, 'modificado': ahora} for clave in sorted(set(claves))])
+
+
+def versiones_datos(session, claves):
+    """Devuelve la versión de cada clave (0 si nunca cambió), en una sola consulta."""
+    versiones = dict(session.execute(
+        select(VersionDatos.clave, VersionDatos.version).where(VersionDatos.clave.in_(claves))
+    ).all())
+    return [versiones.get(clave, 0) for clave in claves]
+
+
+def registrar_cambio_inscripciones(session, operacion, *condiciones):
+    """Anota la operación para cada inscripción que cumple las condiciones.
+
+    También incrementa la versión de datos de sus materias. Las bajas deben
+    anotarse antes de borrar las inscripciones.
+    """
+    incrementar_versiones(session, *(
+        f'materia:{materia_id}'
+        for materia_id in session.scalars(select(Inscripcion.materia_id).distinct().where(*condiciones))
+        if materia_id is not None
+    ))
+    session.execute(insert(Cambio).from_select(
+        ['entidad', 'entidad_id', 'materia_id', 'operacion', 'fecha_hora'],
+        select(literal(ENTIDAD_INSCRIPCION), Inscripcion.id, Inscripcion.materia_id, literal(operacion),
+               literal(datetime.datetime.now()))
+        .where(*condiciones).order_by(Inscripcion.id),
+    ))
+
+
+def aplicar_asistencias(session, valores):
+    """Guarda en bloque un diccionario {(inscripcion_id, fecha): presente}.
+
+    Solo se escriben las filas nuevas o cuyo valor de 'presente' cambió,
+    mediante un único upsert por lote sobre (inscripcion_id, fecha). Lanza
+    FechaArchivada si alguna fecha pertenece a un periodo archivado.
+    """
+    # Los registros existentes se buscan por fecha con 'inscripcion_id IN (...)':
+    # SQLite no siempre usa el índice con 'IN' sobre tuplas (inscripcion_id, fecha)
+    por_fecha = {}
+    for inscripcion_id, fecha in valores:
+        por_fecha.setdefault(fecha, []).append(inscripcion_id)
+    comprobar_fechas(session, por_fecha)
+    if not valores:
+        return ResultadoRegistro(0, 0, 0)
+    # La versión se anota ANTES de leer los registros existentes: pysqlite no
+    # abre la transacción hasta la primera escritura, y este INSERT toma el
+    # bloqueo de escritura. Así dos envíos simultáneos de la misma hoja no
+    # pueden ver ambos "sin registro" y sumar dos veces a los contadores.
+    version = nueva_version(session)
+    existentes = {}
+    for fecha, inscripciones_ids in por_fecha.items():
+        for lote in lotes(inscripciones_ids):
+            filas = session.execute(
+                select(Asistencia.inscripcion_id, Asistencia.presente)
+                .where(Asistencia.fecha == fecha, Asistencia.inscripcion_id.in_(lote))
+            )
+            existentes.update(((fila.inscripcion_id, fecha), fila.presente) for fila in filas)
+
+    insertados = actualizados = 0
+    cambios = []
+    # Variación de los contadores por inscripción: [clases, presentes, última fecha]
+    deltas = {}
+    for (inscripcion_id, fecha), presente in valores.items():
+        anterior = existentes.get((inscripcion_id, fecha))
+        if anterior is None:
+            insertados += 1
+            delta = deltas.setdefault(inscripcion_id, [0, 0, fecha])
+            delta[0] += 1
+            delta[1] += 1 if presente else 0
+            delta[2] = max(delta[2], fecha)
+        elif anterior != presente:
+            actualizados += 1
+            delta = deltas.setdefault(inscripcion_id, [0, 0, None])
+            delta[1] += 1 if presente else -1
+        else:
+            continue
+        cambios.append({'inscripcion_id': inscripcion_id, 'fecha': fecha, 'presente': presente})
+
+    if not cambios:
+        # Nada que escribir: la versión no queda en el registro de cambios
+        session.execute(delete(Cambio).where(Cambio.id == version))
+    for cambio in cambios:
+        cambio['version'] = version
+    for lote in lotes(cambios):
+        stmt = _insert(session, Asistencia)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['inscripcion_id', 'fecha'],
+            set_={'presente': stmt.excluded.presente, 'version': stmt.excluded.version},
+            where=Asistencia.presente != stmt.excluded.presente,
+        )
+        session.execute(stmt, lote)
+    actualizar_resumen(session, deltas)
+
+    return ResultadoRegistro(insertados, actualizados, len(valores) - len(cambios))
+
+
+def actualizar_resumen(session, deltas):
+    """Suma en bloque {inscripcion_id: (clases, presentes, ultima_fecha)} a los contadores."""
+    filas = [
+        {'inscripcion_id': inscripcion_id, 'total_clases': clases,
+         'clases_presente': presentes, 'ultima_fecha': ultima_fecha}
+        for inscripcion_id, (clases, presentes, ultima_fecha) in deltas.items()
+    ]
+    for lote in lotes(filas):
+        stmt = _insert(session, ResumenAsistencia)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['inscripcion_id'],
+            set_={
+                'total_clases': ResumenAsistencia.total_clases + stmt.excluded.total_clases,
+                'clases_presente': ResumenAsistencia.clases_presente + stmt.excluded.clases_presente,
+                'ultima_fecha': case(
+                    (stmt.excluded.ultima_fecha.is_(None), ResumenAsistencia.ultima_fecha),
+                    (ResumenAsistencia.ultima_fecha.is_(None), stmt.excluded.ultima_fecha),
+                    (stmt.excluded.ultima_fecha > ResumenAsistencia.ultima_fecha, stmt.excluded.ultima_fecha),
+                    else_=ResumenAsistencia.ultima_fecha,
+                ),
+            },
+        )
+        session.execute(stmt, lote)
+
+
+def alternar_asistencia(session, asistencia):
+    """Invierte el estado de un registro y ajusta sus contadores.
+
+    El estado se invierte en la propia sentencia UPDATE (no a partir del valor
+    leído antes), así dos correcciones simultáneas no descuadran los contadores.
+    """
+    version = nueva_version(session)
+    presente = session.execute(
+        update(Asistencia).where(Asistencia.id == asistencia.id)
+        .values(presente=not_(Asistencia.presente), version=version)
+        .returning(Asistencia.presente)
+        .execution_options(synchronize_session=False)
+    ).scalar_one()
+    session.expire(asistencia, ['presente', 'version'])
+    actualizar_resumen(session, {asistencia.inscripcion_id: (0, 1 if presente else -1, None)})
+    incrementar_versiones(session, f'materia:{asistencia.inscripcion.materia_id}')
+
+
+def inscritos_por_materia(session, materias_ids):
+    """Devuelve {materia_id: [inscripcion_id, ...]} con una consulta por lote."""
+    inscritos = {materia_id: [] for materia_id in materias_ids}
+    for lote in lotes(sorted(inscritos)):
+        for materia_id, inscripcion_id in session.execute(
+            select(Inscripcion.materia_id, Inscripcion.id).where(Inscripcion.materia_id.in_(lote))
+        ):
+            inscritos[materia_id].append(inscripcion_id)
+    return inscritos
+
+
+def registrar_hojas(session, hojas):
+    """Registra varias listas de asistencia [(materia_id, fecha, presentes_ids)] a la vez.
+
+    Cada lista cubre a todos los inscritos de la materia en esa fecha; si dos
+    listas coinciden en materia y fecha, gana la última. Devuelve
+    (ResultadoRegistro, ignorados), donde ignorados tiene, por cada lista, los
+    ids de 'presentes_ids' que no son inscripciones de la materia.
+    """
+    inscritos = inscritos_por_materia(session, {materia_id for materia_id, _, _ in hojas})
+    valores = {}
+    ignorados = []
+    for materia_id, fecha, presentes_ids in hojas:
+        presentes_ids = set(presentes_ids)
+        for inscripcion_id in inscritos[materia_id]:
+            valores[(inscripcion_id, fecha)] = inscripcion_id in presentes_ids
+        ignorados.append(sorted(presentes_ids.difference(inscritos[materia_id])))
+    resultado = aplicar_asistencias(session, valores)
+    if resultado.insertados or resultado.actualizados:
+        incrementar_versiones(session, *(f'materia:{materia_id}' for materia_id in inscritos))
+    return resultado, ignorados
+
+
+def registrar_asistencia_materia(session, materia_id, fecha, presentes_ids):
+    """Registra la asistencia de una fecha para todos los inscritos de una materia."""
+    resultado, _ = registrar_hojas(session, [(materia_id, fecha, presentes_ids)])
+    return resultado
+
+
+def estadisticas_asistencia(session, inscripcion_ids=None, estudiante_id=None, materia_id=None, profesor_id=None):
+    """Devuelve total, presentes y tasa (%) por inscripción leyendo los contadores.
+
+    Los filtros se combinan; devuelve {inscripcion_id: EstadisticaAsistencia},
+    incluyendo las inscripciones que aún no tienen registros.
+    """
+    consulta = (
+        select(Inscripcion.id, ResumenAsistencia.total_clases, ResumenAsistencia.clases_presente)
+        .select_from(Inscripcion)
+        .outerjoin(ResumenAsistencia, ResumenAsistencia.inscripcion_id == Inscripcion.id)
+    )
+    if inscripcion_ids is not None:
+        consulta = consulta.where(Inscripcion.id.in_(list(inscripcion_ids)))
+    if estudiante_id is not None:
+        consulta = consulta.where(Inscripcion.estudiante_id == estudiante_id)
+    if materia_id is not None:
+        consulta = consulta.where(Inscripcion.materia_id == materia_id)
+    if profesor_id is not None:
+        consulta = consulta.join(Materia, Materia.id == Inscripcion.materia_id).where(Materia.profesor_id == profesor_id)
+
+    estadisticas = {}
+    for inscripcion_id, total, presentes in session.execute(consulta):
+        total, presentes = total or 0, presentes or 0
+        estadisticas[inscripcion_id] = EstadisticaAsistencia(total, presentes, (presentes / total) * 100 if total else 0)
+    return estadisticas
+
+
+def _contar_asistencias(session):
+    """Recalcula los contadores de todas las inscripciones desde asistencias y el archivo."""
+    presentes = func.sum(case((Asistencia.presente, 1), else_=0))
+    consulta = (
+        select(Asistencia.inscripcion_id, func.count(), presentes, func.max(Asistencia.fecha))
+        .where(Asistencia.inscripcion_id.isnot(None))
+        # Las asistencias de materias eliminadas pendientes de purga ya no cuentan
+        .where(Asistencia.inscripcion_id.notin_(select(Inscripcion.id).where(Inscripcion.purga_id.isnot(None))))
+        .group_by(Asistencia.inscripcion_id)
+    )
+    reales = {fila[0]: tuple(fila[1:]) for fila in session.execute(consulta)}
+    archivadas = (
+        select(AsistenciaArchivada.inscripcion_id, func.sum(AsistenciaArchivada.total_clases),
+               func.sum(AsistenciaArchivada.clases_presente), func.max(AsistenciaArchivada.fecha_fin))
+        .group_by(AsistenciaArchivada.inscripcion_id)
+    )
+    for inscripcion_id, total, presentes, ultima_fecha in session.execute(archivadas):
+        # Las fechas vivas son siempre posteriores a las archivadas
+        total_vivo, presentes_vivo, ultima_viva = reales.get(inscripcion_id, (0, 0, None))
+        reales[inscripcion_id] = (total + total_vivo, presentes + presentes_vivo, ultima_viva or ultima_fecha)
+    return reales
+
+
+def reconstruir_resumen(session, solo_verificar=False):
+    """Compara los contadores con los datos originales y, si se pide, los reconstruye.
+
+    Devuelve la lista de DiferenciaResumen encontradas antes de reconstruir.
+    """
+    reales = _contar_asistencias(session)
+    guardados = {
+        fila[0]: tuple(fila[1:])
+        for fila in session.execute(select(
+            ResumenAsistencia.inscripcion_id, ResumenAsistencia.total_clases,
+            ResumenAsistencia.clases_presente, ResumenAsistencia.ultima_fecha,
+        ))
+    }
+    vacio = (0, 0, None)
+    diferencias = [
+        DiferenciaResumen(inscripcion_id, guardados.get(inscripcion_id, vacio), reales.get(inscripcion_id, vacio))
+        for inscripcion_id in sorted(reales.keys() | guardados.keys())
+        if guardados.get(inscripcion_id, vacio) != reales.get(inscripcion_id, vacio)
+    ]
+
+    if not solo_verificar and diferencias:
+        session.execute(ResumenAsistencia.__table__.delete())
+        filas = [
+            {'inscripcion_id': inscripcion_id, 'total_clases': total,
+             'clases_presente': presentes, 'ultima_fecha': ultima_fecha}
+            for inscripcion_id, (total, presentes, ultima_fecha) in reales.items()
+        ]
+        for lote in lotes(filas):
+            session.execute(ResumenAsistencia.__table__.insert(), lote)
+    return diferencias
+
+
+def historial_asistencias(session, materia_id, desde=None, hasta=None, estudiante_id=None,
+                          cursor=None, limite=TAMANO_PAGINA_HISTORIAL):
+    """Devuelve una página del historial de una materia, de la fecha más reciente a la más antigua.
+
+    Usa paginación por clave (fecha, id): 'cursor' es el valor devuelto por la
+    página anterior. El estudiante se carga en la misma consulta. Devuelve
+    (asistencias, cursor_siguiente), con cursor_siguiente=None en la última página.
+    Tras los registros vivos siguen los archivados (RegistroArchivado), cuyo
+    cursor usa el id de la inscripción.
+    """
+    limite_archivo = fecha_limite_archivo(session)
+    asistencias = []
+    # Todas las fechas vivas son posteriores a las archivadas
+    if cursor is None or limite_archivo is None or cursor[0] > limite_archivo:
+        consulta = (
+            session.query(Asistencia)
+            .join(Asistencia.inscripcion)
+            .join(Inscripcion.estudiante)
+            .options(contains_eager(Asistencia.inscripcion).contains_eager(Inscripcion.estudiante))
+            .filter(Inscripcion.materia_id == materia_id)
+        )
+        if desde is not None:
+            consulta = consulta.filter(Asistencia.fecha >= desde)
+        if hasta is not None:
+            consulta = consulta.filter(Asistencia.fecha <= hasta)
+        if estudiante_id is not None:
+            consulta = consulta.filter(Inscripcion.estudiante_id == estudiante_id)
+        if cursor is not None:
+            fecha_cursor, id_cursor = cursor
+            consulta = consulta.filter(or_(
+                Asistencia.fecha < fecha_cursor,
+                and_(Asistencia.fecha == fecha_cursor, Asistencia.id < id_cursor),
+            ))
+        # Se pide un registro de más para saber si existe otra página
+        asistencias = consulta.order_by(Asistencia.fecha.desc(), Asistencia.id.desc()).limit(limite + 1).all()
+
+    if len(asistencias) <= limite and limite_archivo is not None:
+        cursor_archivo = cursor if cursor is not None and cursor[0] <= limite_archivo else None
+        asistencias += _historial_archivado(
+            session, materia_id, desde, hasta, estudiante_id, cursor_archivo, limite + 1 - len(asistencias)
+        )
+
+    cursor_siguiente = None
+    if len(asistencias) > limite:
+        asistencias = asistencias[:limite]
+        ultimo = asistencias[-1]
+        cursor_siguiente = (ultimo.fecha, ultimo.inscripcion.id if isinstance(ultimo, RegistroArchivado) else ultimo.id)
+    return asistencias, cursor_siguiente
+
+
+def _historial_archivado(session, materia_id, desde, hasta, estudiante_id, cursor, limite):
+    """Registros archivados de una materia en orden descendente de (fecha, inscripción)."""
+    if cursor is not None:
+        hasta = min(hasta, cursor[0]) if hasta is not None else cursor[0]
+    consulta = consulta_archivada().where(Inscripcion.materia_id == materia_id)
+    if estudiante_id is not None:
+        consulta = consulta.where(Inscripcion.estudiante_id == estudiante_id)
+    # Se recorre hacia atrás y se para en 'limite': no se decodifica el archivo entero
+    registros = registros_archivados(session, consulta, desde, hasta, descendente=True)
+    if cursor is not None:
+        registros = dropwhile(lambda registro: registro[:2] >= cursor, registros)
+    registros = list(islice(registros, limite))
+    if not registros:
+        return []
+
+    # Solo las inscripciones de la página, con su estudiante
+    inscripciones = session.query(Inscripcion).join(Inscripcion.estudiante).options(
+        contains_eager(Inscripcion.estudiante)
+    ).filter(Inscripcion.id.in_({inscripcion_id for _, inscripcion_id, _ in registros}))
+    inscripciones = {inscripcion.id: inscripcion for inscripcion in inscripciones}
+    return [
+        RegistroArchivado(fecha, presente, inscripciones[inscripcion_id], True)
+        for fecha, inscripcion_id, presente in registros
+    ]
+
+
+# --- SINCRONIZACIÓN INCREMENTAL (registro de cambios) ---
+
+def cambios_inscripciones(session, cursor=0, materias_ids=None, limite=TAMANO_PAGINA_CAMBIOS):
+    """Altas, bajas y modificaciones de inscripciones posteriores al cambio 'cursor'.
+
+    Devuelve (cambios, cursor_siguiente, hay_mas); cada cambio es un diccionario
+    con el estudiante actual de la inscripción (None en las bajas, porque SQLite
+    puede reutilizar el id de una inscripción borrada).
+    """
+    consulta = (
+        select(Cambio.id, Cambio.operacion, Cambio.entidad_id, Cambio.materia_id,
+               Estudiante.id, Estudiante.codigo_estudiante, Estudiante.nombre, Estudiante.apellido,
+               Estudiante.is_active)
+        .outerjoin(Inscripcion, Inscripcion.id == Cambio.entidad_id)
+        .outerjoin(Estudiante, Estudiante.id == Inscripcion.estudiante_id)
+        .where(Cambio.entidad == ENTIDAD_INSCRIPCION, Cambio.id > cursor)
+    )
+    if materias_ids:
+        consulta = consulta.where(Cambio.materia_id.in_(materias_ids))
+    filas = session.execute(consulta.order_by(Cambio.id).limit(limite + 1)).all()
+    hay_mas = len(filas) > limite
+    filas = filas[:limite]
+    cambios = [
+        {'cambio': cambio_id, 'operacion': operacion, 'inscripcion_id': inscripcion_id,
+         'materia_id': materia_id,
+         'estudiante': None if estudiante_id is None or operacion == BAJA else {
+             'id': estudiante_id, 'codigo_estudiante': codigo, 'nombre': nombre,
+             'apellido': apellido, 'activo': activo}}
+        for cambio_id, operacion, inscripcion_id, materia_id, estudiante_id, codigo, nombre, apellido, activo in filas
+    ]
+    return cambios, (filas[-1][0] if filas else cursor), hay_mas
+
+
+def cambios_asistencias(session, cursor=None, materias_ids=None, limite=TAMANO_PAGINA_CAMBIOS):
+    """Registros de asistencia escritos después de 'cursor', en orden de versión.
+
+    Paginación por clave (version, id); sin cursor se devuelven todos. Devuelve
+    (registros, cursor_siguiente, hay_mas).
+    """
+    consulta = (
+        select(Asistencia.id, Asistencia.inscripcion_id, Inscripcion.materia_id, Asistencia.fecha,
+               Asistencia.presente, Asistencia.version)
+        .join(Inscripcion, Inscripcion.id == Asistencia.inscripcion_id)
+        # Sin las inscripciones de materias eliminadas pendientes de purga
+        .where(Inscripcion.materia_id.isnot(None))
+    )
+    if materias_ids:
+        consulta = consulta.where(Inscripcion.materia_id.in_(materias_ids))
+    if cursor is not None:
+        version_cursor, id_cursor = cursor
+        # 'version >= ...' permite recorrer el índice por versión
+        consulta = consulta.where(Asistencia.version >= version_cursor, or_(
+            Asistencia.version > version_cursor,
+            and_(Asistencia.version == version_cursor, Asistencia.id > id_cursor),
+        ))
+    filas = session.execute(consulta.order_by(Asistencia.version, Asistencia.id).limit(limite + 1)).all()
+    hay_mas = len(filas) > limite
+    filas = filas[:limite]
+    registros = [
+        {'id': id, 'inscripcion_id': inscripcion_id, 'materia_id': materia_id,
+         'fecha': fecha.isoformat(), 'presente': presente, 'version': version}
+        for id, inscripcion_id, materia_id, fecha, presente, version in filas
+    ]
+    cursor_siguiente = (filas[-1].version, filas[-1].id) if filas else cursor
+    return registros, cursor_siguiente, hay_mas
+
+
+class MatrizAsistencia:
+    """Asistencia de una materia como matriz estudiantes x fechas.
+
+    Las celdas se guardan en un bytearray (fila por estudiante, columna por
+    fecha) con los códigos SIN_REGISTRO, AUSENTE y PRESENTE, de modo que los
+    totales se calculan con operaciones de bytes en C y no celda a celda.
+    """
+
+    def __init__(self, estudiantes, fechas, celdas):
+        self.estudiantes = estudiantes
+        self.fechas = fechas
+        self.celdas = celdas
+
+    def fila(self, indice):
+        ancho = len(self.fechas)
+        return self.celdas[indice * ancho:(indice + 1) * ancho]
+
+    def columna(self, indice):
+        return self.celdas[indice::len(self.fechas)]
+
+    def filas(self):
+        """Genera (estudiante, celdas, presentes, clases) para cada estudiante."""
+        for indice, estudiante in enumerate(self.estudiantes):
+            fila = self.fila(indice)
+            yield estudiante, fila, fila.count(PRESENTE), len(fila) - fila.count(SIN_REGISTRO)
+
+    def totales_por_fecha(self):
+        """Devuelve [(presentes, clases)] para cada fecha."""
+        totales = []
+        for indice in range(len(self.fechas)):
+            columna = self.columna(indice)
+            totales.append((columna.count(PRESENTE), len(columna) - columna.count(SIN_REGISTRO)))
+        return totales
+
+
+def matriz_asistencia(session, materia_id, desde=None, hasta=None, limite_fechas=FECHAS_MATRIZ):
+    """Construye la MatrizAsistencia de una materia entre dos fechas.
+
+    Sin 'desde' se muestran como máximo las últimas 'limite_fechas' fechas con
+    clase. Incluye los registros archivados del rango.
+    """
+    estudiantes = session.execute(
+        select(Inscripcion.id, Estudiante.codigo_estudiante, Estudiante.nombre, Estudiante.apellido)
+        .join(Estudiante, Estudiante.id == Inscripcion.estudiante_id)
+        .where(Inscripcion.materia_id == materia_id)
+        .order_by(Estudiante.apellido, Estudiante.nombre)
+    ).all()
+
+    limite_archivo = fecha_limite_archivo(session)
+    consulta_archivo = consulta_archivada().where(Inscripcion.materia_id == materia_id)
+    filtro = [Inscripcion.materia_id == materia_id]
+    if hasta is not None:
+        filtro.append(Asistencia.fecha <= hasta)
+    if desde is None:
+        ultimas = session.scalars(
+            select(Asistencia.fecha).distinct().join(Inscripcion, Inscripcion.id == Asistencia.inscripcion_id)
+            .where(*filtro).order_by(Asistencia.fecha.desc()).limit(limite_fechas)
+        ).all()
+        if len(ultimas) < limite_fechas and limite_archivo is not None:
+            anteriores = sorted({fecha for fecha, _, _ in registros_archivados(session, consulta_archivo, None, hasta)})
+            ultimas += anteriores[::-1][:limite_fechas - len(ultimas)]
+        desde = ultimas[-1] if ultimas else None
+    if desde is not None:
+        filtro.append(Asistencia.fecha >= desde)
+
+    # Una sola consulta por columnas, ejecutada en Core para no pasar por la
+    # capa de carga del ORM. La fecha se lee sin convertir (texto en SQLite) y
+    # se convierte una vez por fecha distinta.
+    registros = session.connection().execute(
+        select(Asistencia.inscripcion_id, type_coerce(Asistencia.fecha, String), Asistencia.presente)
+        .join(Inscripcion, Inscripcion.id == Asistencia.inscripcion_id)
+        .where(*filtro)
+    ).all()
+    archivados = []
+    if limite_archivo is not None and (desde is None or desde <= limite_archivo):
+        archivados = list(registros_archivados(session, consulta_archivo, desde, hasta))
+
+    # Las fechas archivadas son siempre anteriores a las vivas
+    claves = sorted({fecha for _, fecha, _ in registros})
+    fechas_archivo = sorted({fecha for fecha, _, _ in archivados})
+    fechas = fechas_archivo + [datetime.date.fromisoformat(clave) if isinstance(clave, str) else clave for clave in claves]
+    ancho = len(fechas)
+    columna_de = {clave: len(fechas_archivo) + indice for indice, clave in enumerate(claves)}
+    columna_de.update((fecha, indice) for indice, fecha in enumerate(fechas_archivo))
+    fila_de = {estudiante.id: indice for indice, estudiante in enumerate(estudiantes)}
+    celdas = bytearray(len(estudiantes) * ancho)
+    for inscripcion_id, fecha, presente in registros:
+        fila = fila_de.get(inscripcion_id)
+        if fila is not None:
+            celdas[fila * ancho + columna_de[fecha]] = PRESENTE if presente else AUSENTE
+    for fecha, inscripcion_id, presente in archivados:
+        fila = fila_de.get(inscripcion_id)
+        if fila is not None:
+            celdas[fila * ancho + columna_de[fecha]] = PRESENTE if presente else AUSENTE
+    return MatrizAsistencia(estudiantes, fechas, celdas)
+
+
+# --- LISTADOS DE REFERENCIA (datos simples, aptos para la caché) ---
+
+def listado_materias(session, ordenar=False):
+    """Materias de profesores activos, como diccionarios con el profesor anidado."""
+    consulta = (
+        select(Materia.id, Materia.nombre_materia, Materia.codigo_materia, Materia.profesor_id,
+               Profesor.nombre, Profesor.apellido)
+        .join(Profesor, Profesor.id == Materia.profesor_id)
+        .where(Profesor.is_active == True)
+    )
+    if ordenar:
+        consulta = consulta.order_by(Materia.nombre_materia)
+    return [
+        {'id': id, 'nombre_materia': nombre_materia, 'codigo_materia': codigo_materia,
+         'profesor_id': profesor_id, 'profesor': {'nombre': nombre, 'apellido': apellido}}
+        for id, nombre_materia, codigo_materia, profesor_id, nombre, apellido in session.execute(consulta)
+    ]
+
+
+def listado_profesores(session):
+    """Profesores activos ordenados por apellido, como diccionarios."""
+    consulta = (
+        select(Profesor.id, Profesor.nombre, Profesor.apellido, Profesor.especialidad)
+        .where(Profesor.is_active == True)
+        .order_by(Profesor.apellido)
+    )
+    return [dict(fila._mapping) for fila in session.execute(consulta)]
+
+
+# Índice de texto completo de estudiantes (ver database_migrate.crear_indice_busqueda)
+estudiantes_fts = table('estudiantes_fts', column('rowid'))
+
+
+def _indice_busqueda_disponible(session):
+    """Indica si existe la tabla FTS5 de estudiantes (SQLite compilado con FTS5)."""
+    if session.get_bind().dialect.name != 'sqlite':
+        return False
+    return session.scalar(text("SELECT 1 FROM sqlite_master WHERE name = 'estudiantes_fts'")) is not None
+
+
+def buscar_estudiantes(session, texto='', pagina=1, limite=TAMANO_PAGINA_ESTUDIANTES):
+    """Estudiantes activos cuyo nombre, apellido o código empiezan por cada palabra de 'texto'.
+
+    Sin texto devuelve todos los activos. Ordena por apellido y pagina por
+    número de página. Con el índice FTS5 la búsqueda es por prefijo e ignora
+    acentos; sin él se usa LIKE, también por prefijo (sin ignorar acentos).
+    Devuelve (estudiantes, hay_mas), con los estudiantes como diccionarios.
+    """
+    consulta = (
+        select(Estudiante.id, Estudiante.nombre, Estudiante.apellido, Estudiante.codigo_estudiante)
+        .where(Estudiante.is_active == True)
+    )
+    palabras = re.findall(r'\w+', texto or '')
+    if palabras and _indice_busqueda_disponible(session):
+        # "palabra"* es una búsqueda por prefijo; varias palabras deben aparecer todas
+        expresion = ' '.join(f'"{palabra}"*' for palabra in palabras)
+        consulta = consulta.join(estudiantes_fts, estudiantes_fts.c.rowid == Estudiante.id).where(
+            text('estudiantes_fts MATCH :expresion').bindparams(expresion=expresion)
+        )
+    else:
+        for palabra in palabras:
+            consulta = consulta.where(or_(
+                Estudiante.nombre.istartswith(palabra, autoescape=True),
+                Estudiante.apellido.istartswith(palabra, autoescape=True),
+                Estudiante.codigo_estudiante.istartswith(palabra, autoescape=True),
+            ))
+    filas = session.execute(
+        consulta.order_by(Estudiante.apellido, Estudiante.nombre, Estudiante.id)
+        .limit(limite + 1).offset((pagina - 1) * limite)
+    ).all()
+    return [dict(fila._mapping) for fila in filas[:limite]], len(filas) > limite
@@ -0,0 +1,33 @@
+# test_api_sincronizacion.py
+# Validación de los cursores de la API de sincronización: un cursor mal
+# formado responde 400 en los dos endpoints. Uso: python -m pytest -q
+import os
+import tempfile
+
+# La URL debe fijarse antes de importar models (el engine se crea al importarlo)
+os.environ['ASISTENCIA_DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'prueba.db')}"
+
+import pytest
+from app import app
+from models import Base, engine, session
+
+
+@pytest.fixture
+def cliente():
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    yield app.test_client()
+    session.remove()
+
+
+@pytest.mark.parametrize('ruta', ['/api/cambios/inscripciones', '/api/cambios/asistencias'])
+def test_cursor_invalido(cliente, ruta):
+    respuesta = cliente.get(ruta, query_string={'cursor': 'abc'})
+    assert respuesta.status_code == 400
+    assert respuesta.get_json()['errores']
+
+
+def test_cursor_de_inscripciones_valido(cliente):
+    respuesta = cliente.get('/api/cambios/inscripciones', query_string={'cursor': '0'})
+    assert respuesta.status_code == 200
+    assert respuesta.get_json() == {'cambios': [], 'cursor': 0, 'hay_mas': False}
@@ -0,0 +1,42 @@
+# test_database_setup.py
+# database_setup.py sobre una base de datos con el esquema original (el
+# asistencia.db del repositorio): debe dejar el esquema actual, no solo marcar
+# la versión. Uso: python -m pytest -q
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+
+
+def _ejecutar(script, archivo):
+    # En otro proceso: el engine se crea al importar models con la URL del entorno
+    entorno = dict(os.environ, ASISTENCIA_DATABASE_URL=f'sqlite:///{archivo}')
+    return subprocess.run(
+        [sys.executable, os.path.join(DIRECTORIO, script)],
+        cwd=DIRECTORIO, env=entorno, capture_output=True, text=True, check=True,
+    ).stdout
+
+
+def _columnas(conn, tabla):
+    return {fila[1] for fila in conn.execute(f'PRAGMA table_info({tabla})')}
+
+
+def test_setup_sobre_esquema_original(tmp_path):
+    archivo = tmp_path / 'asistencia.db'
+    shutil.copy(os.path.join(DIRECTORIO, 'asistencia.db'), archivo)
+    with sqlite3.connect(archivo) as conn:
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == 0
+        assert 'version' not in _columnas(conn, 'asistencias')
+
+    _ejecutar('database_setup.py', archivo)
+
+    with sqlite3.connect(archivo) as conn:
+        assert 'version' in _columnas(conn, 'asistencias')
+        assert 'purga_id' in _columnas(conn, 'inscripciones')
+        indices = {fila[0] for fila in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        assert {'ux_inscripciones_estudiante_materia', 'ux_asistencias_inscripcion_fecha'} <= indices
+        assert conn.execute('SELECT COUNT(*) FROM inscripciones').fetchone()[0] == 4
+    assert 'ya estaba actualizada' in _ejecutar('database_migrate.py', archivo)
@@ -0,0 +1,101 @@
+# test_resumen_asistencias.py
+# Regresión: dos escrituras simultáneas de asistencia no deben descuadrar los
+# contadores de resumen_asistencias. Uso: python -m pytest -q
+import datetime
+import os
+import tempfile
+import threading
+import time
+
+# La URL debe fijarse antes de importar models (el engine se crea al importarlo)
+_DIRECTORIO = tempfile.mkdtemp()
+os.environ['ASISTENCIA_DATABASE_URL'] = f"sqlite:///{os.path.join(_DIRECTORIO, 'prueba.db')}"
+
+import pytest
+from sqlalchemy import event, select
+from models import Asistencia, Base, Estudiante, Inscripcion, Materia, Profesor, ResumenAsistencia, engine, session
+from servicios import alternar_asistencia, reconstruir_resumen, registrar_asistencia_materia
+
+FECHA = datetime.date(2024, 3, 1)
+
+
+@pytest.fixture
+def inscripcion():
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    profesor = Profesor(nombre='Ana', apellido='Pérez')
+    materia = Materia(nombre_materia='Álgebra', codigo_materia='ALG-1', profesor=profesor)
+    estudiante = Estudiante(nombre='Luis', apellido='Gómez', codigo_estudiante='E1')
+    inscripcion = Inscripcion(estudiante=estudiante, materia=materia)
+    session.add(inscripcion)
+    session.commit()
+    ids = inscripcion.materia_id, inscripcion.id
+    session.remove()
+    yield ids
+    session.remove()
+
+
+def _en_hilo(funcion, *argumentos, nombre=None):
+    def ejecutar():
+        try:
+            funcion(*argumentos)
+            session.commit()
+        finally:
+            session.remove()
+    hilo = threading.Thread(target=ejecutar, name=nombre)
+    hilo.start()
+    return hilo
+
+
+def _contadores(inscripcion_id):
+    resumen = session.get(ResumenAsistencia, inscripcion_id)
+    return resumen.total_clases, resumen.clases_presente
+
+
+def test_misma_hoja_enviada_dos_veces_a_la_vez(inscripcion):
+    materia_id, inscripcion_id = inscripcion
+    leyo = threading.Event()
+
+    # El primer envío se detiene justo después de leer los registros existentes
+    @event.listens_for(engine, 'after_cursor_execute')
+    def pausar(conn, cursor, statement, parameters, context, executemany):
+        if threading.current_thread().name == 'envio-a' and 'FROM asistencias' in statement and not leyo.is_set():
+            leyo.set()
+            time.sleep(0.5)
+
+    try:
+        hilo_a = _en_hilo(registrar_asistencia_materia, session, materia_id, FECHA, [inscripcion_id], nombre='envio-a')
+        assert leyo.wait(5)
+        hilo_b = _en_hilo(registrar_asistencia_materia, session, materia_id, FECHA, [inscripcion_id])
+        hilo_a.join()
+        hilo_b.join()
+    finally:
+        event.remove(engine, 'after_cursor_execute', pausar)
+
+    assert session.scalars(select(Asistencia.presente)).all() == [True]
+    assert _contadores(inscripcion_id) == (1, 1)
+    assert reconstruir_resumen(session, solo_verificar=True) == []
+
+
+def test_dos_correcciones_simultaneas(inscripcion):
+    materia_id, inscripcion_id = inscripcion
+    registrar_asistencia_materia(session, materia_id, FECHA, [])
+    session.commit()
+    asistencia_id = session.scalar(select(Asistencia.id))
+    session.remove()
+
+    # Las dos peticiones leen el registro (ausente) antes de que ninguna escriba
+    leidas = threading.Barrier(2)
+
+    def corregir():
+        asistencia = session.get(Asistencia, asistencia_id)
+        leidas.wait(5)
+        alternar_asistencia(session, asistencia)
+
+    hilos = [_en_hilo(corregir) for _ in range(2)]
+    for hilo in hilos:
+        hilo.join()
+
+    assert session.scalar(select(Asistencia.presente)) is False
+    assert _contadores(inscripcion_id) == (1, 0)
+    assert reconstruir_resumen(session, solo_verificar=True) == []